@@ -0,0 +1,196 @@
+"""Benchmark of the positions fetch against the local mock node, see mocknode.py.
+
+The results are written as JSON and compared against the baseline results of the same parameters if given,
+the exit code is 1 if any of the metrics is worse than the baseline by more than the tolerance."""
+
+import argparse
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+from typing import Any, Callable
+
+MOCK_NODE = Path(__file__).with_name("mocknode.py")
+
+# metrics compared against the baseline and whether the higher value is better
+COMPARED_METRICS = {"seconds": False, "calls_per_second": True, "peak_rss_mb": False}
+# stages of the baseline shorter than that are too noisy to compare
+MIN_COMPARED_SECONDS = 0.5
+
+
+class MockNode:
+    """Mock node running in a separate process, so it doesn't share the interpreter with the bot"""
+
+    def __init__(self, holders: int, latency: float, error_rate: float) -> None:
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+
+        args = ["--port", self.port, "--holders", holders, "--latency", latency, "--error-rate", error_rate]
+        self.process = subprocess.Popen([sys.executable, str(MOCK_NODE), *map(str, args)])
+        self.uri = f"http://127.0.0.1:{self.port}"
+
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                self.state = self.get_state()
+                break
+            except OSError:
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+
+    def get_state(self) -> dict[str, Any]:
+        """Get layout of the chain and the counters of the node"""
+        with urllib.request.urlopen(self.uri, timeout=5) as response:
+            return json.load(response)
+
+    def stop(self) -> None:
+        """Stop the node process"""
+        self.process.terminate()
+        self.process.wait()
+
+
+def measure(nodes: list[MockNode], stages: list[tuple[str, Callable[[], Any]]]) -> dict[str, dict[str, float]]:
+    """Run the stages in order and get the wall time, the requests served by the nodes and the peak memory of each"""
+
+    results = {}
+    for name, stage in stages:
+        before = [n.get_state() for n in nodes]
+        started = time.perf_counter()
+        stage()
+        seconds = time.perf_counter() - started
+        after = [n.get_state() for n in nodes]
+
+        counters = {k: sum(a[k] - b[k] for a, b in zip(after, before)) for k in ("requests", "calls", "logs", "errors")}
+        results[name] = {
+            "seconds": seconds,
+            **counters,
+            "calls_per_second": counters["calls"] / seconds if seconds else 0.0,
+            # peak resident memory of the process so far, so it's non-decreasing over the stages
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        }
+    return results
+
+
+def run(args: argparse.Namespace, nodes: list[MockNode]) -> dict[str, dict[str, float]]:
+    """Fetch the positions of the worker from the mock nodes stage by stage"""
+
+    os.environ["NODE_ENDPOINT"] = nodes[0].uri
+    os.environ["FALLBACK_NODE_ENDPOINT"] = nodes[1].uri if len(nodes) > 1 else ""
+    os.environ["EXTRA_NODE_ENDPOINTS"] = ",".join(n.uri for n in nodes[2:])
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    # persistent stores would carry the state of the previous runs
+    for name in ("HOLDERS_DB_PATH", "CALL_CACHE_DB_PATH"):
+        os.environ.pop(name, None)
+
+    # the bot is configured by the environment on import
+    # pylint: disable=import-outside-toplevel
+    from bot import aaveparser, asyncparser, worker
+    from bot.analytics import get_bins_values, prepare_data
+    from bot.config import FETCH_BACKEND
+    from bot.structs import AddressSet
+
+    w = getattr(worker, args.worker, None)
+    if not isinstance(w, worker.Worker):
+        raise ValueError(f"Unknown worker {args.worker}")
+    w.ctx.init_block = nodes[0].state["first_block"] - 1
+
+    frames = []
+    if FETCH_BACKEND == "asyncio":
+        stages = [("fetch", lambda: frames.append(asyncparser.fetch(w.ctx, w.pair)))]
+    else:
+        touched = AddressSet()
+
+        def _get_holders() -> None:
+            w.ctx.curr_block = aaveparser.get_latest_block_number(w.pair.chain_id)
+            touched.update(aaveparser.find_new_atoken_holders(w.ctx, w.pair))
+
+        stages = [
+            ("holders", _get_holders),
+            ("positions", lambda: frames.append(aaveparser.read_positions(w.ctx, w.pair, touched))),
+        ]
+    bins = w.bins
+
+    def _analyze() -> None:
+        if not frames or frames[0] is None:
+            # e.g. asyncio fetch results in None without holders found, the reason is logged by the bot
+            sys.exit(f"Fetch of {args.worker} has failed, no positions to analyze")
+        get_bins_values(prepare_data(frames[0]), bins)
+
+    stages.append(("analytics", _analyze))
+
+    results = measure(nodes, stages)
+    total = {k: sum(r[k] for r in results.values()) for k in ("seconds", "requests", "calls", "logs", "errors")}
+    total["calls_per_second"] = total["calls"] / total["seconds"]
+    total["peak_rss_mb"] = max(r["peak_rss_mb"] for r in results.values())
+    total["positions"] = len(frames[0])
+    results["total"] = total
+    return results
+
+
+def compare(results: dict[str, Any], baseline: dict[str, Any], tolerance: float) -> list[str]:
+    """Print the changes of the metrics against the baseline and get the regressed ones"""
+
+    if results["params"] != baseline["params"]:
+        print(f"Parameters differ from the baseline ones {baseline['params']}", file=sys.stderr)
+
+    regressions = []
+    for stage, metrics in results["stages"].items():
+        if baseline["stages"].get(stage, {}).get("seconds", 0) < MIN_COMPARED_SECONDS:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            base = baseline["stages"][stage].get(metric)
+            if not base:
+                continue
+            change = metrics[metric] / base - 1
+            regressed = (-change if higher_is_better else change) > tolerance
+            print(f"{stage:>10} {metric:>18} {base:12.2f} -> {metrics[metric]:12.2f} {change:+8.1%}")
+            if regressed:
+                regressions.append(f"{stage}.{metric}")
+    return regressions
+
+
+def main() -> None:
+    """Run the benchmark and compare the results against the baseline"""
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--worker", default="astETH", help="name of the worker defined in bot/worker.py")
+    parser.add_argument("--holders", type=int, default=1000, help="number of the aToken holders of the mock chain")
+    parser.add_argument("--latency", type=float, default=0, help="delay of every HTTP request (in seconds)")
+    parser.add_argument("--error-rate", type=float, default=0, help="share of HTTP requests failed with 503 status")
+    parser.add_argument("--nodes", type=int, default=1, help="number of the mock nodes, the extra ones are fallbacks")
+    parser.add_argument("--out", help="path to write the results to as JSON")
+    parser.add_argument("--baseline", help="path to the results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="max share of a metric to get worse by")
+    args = parser.parse_args()
+
+    params = {k: getattr(args, k) for k in ("worker", "holders", "latency", "error_rate", "nodes")}
+    params["backend"] = os.getenv("FETCH_BACKEND", "threads")
+
+    nodes = [MockNode(args.holders, args.latency, args.error_rate) for _ in range(max(args.nodes, 1))]
+    try:
+        results = {"params": params, "stages": run(args, nodes)}
+    finally:
+        for node in nodes:
+            node.stop()
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.out:
+        Path(args.out).write_text(output + "\n", encoding="utf-8")
+
+    if args.baseline:
+        regressions = compare(results, json.loads(Path(args.baseline).read_text(encoding="utf-8")), args.tolerance)
+        if regressions:
+            print(f"Regressed by more than {args.tolerance:.0%}: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
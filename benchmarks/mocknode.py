@@ -0,0 +1,297 @@
+"""Stand-in JSON-RPC node serving a synthetic AAVE pool to benchmark the bot without a provider.
+
+The chain is frozen at the block HEAD. The i-th of the holders gets the aToken by a transfer at the block
+`first_block + i * TRANSFERS_STEP`, any token address is treated as a token of the pool. Balances and account data
+of a user are derived from the user's address, so the answers are the same across the runs.
+
+`GET /` returns the layout of the chain and the counters of the served requests."""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable
+
+from eth_abi import decode_abi, encode_abi
+from eth_utils import function_signature_to_4byte_selector, keccak
+
+HEAD = 20_000_000
+TRANSFERS_STEP = 10
+TIMESTAMP = 1_700_000_000  # timestamp of the HEAD block
+
+TRANSFER_TOPIC = "0x" + keccak(text="Transfer(address,address,uint256)").hex()
+ZERO_WORD = "0x" + "00" * 32
+ZERO_ADDRESS = "0x" + "00" * 20
+
+# reserves of the pool for the local health factors engine: asset, aToken, stable and variable debt tokens,
+# price, liquidation threshold and LTV, all of them belong to the e-mode category 1
+RESERVES = [
+    ("0x" + "a0" * 20, "0x" + "b0" * 20, "0x" + "c0" * 20, "0x" + "d0" * 20, 2 * 10**8, 8000, 7500),
+    ("0x" + "a1" * 20, "0x" + "b1" * 20, "0x" + "c1" * 20, "0x" + "d1" * 20, 3 * 10**8, 8250, 8000),
+]
+RESERVE_TOKENS = {token for reserve in RESERVES for token in reserve[1:4]}
+STABLE_DEBT_TOKENS = {reserve[2] for reserve in RESERVES}
+
+
+class Counters:
+    """Thread-safe counters of the served requests"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.values = {"requests": 0, "calls": 0, "logs": 0, "errors": 0}
+
+    def inc(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self.values[name] += value
+
+
+class Chain:
+    """Synthetic state of the chain"""
+
+    def __init__(self, chain_id: int, holders: int) -> None:
+        self.chain_id = chain_id
+        self.holders = holders
+        self.first_block = HEAD - holders * TRANSFERS_STEP
+        self.counters = Counters()
+        self.methods: dict[bytes, Callable[[str, bytes], bytes]] = {
+            _selector("balanceOf(address)"): self._balance_of,
+            _selector("getUserAccountData(address)"): self._user_account_data,
+            _selector("getUserEMode(address)"): lambda _, data: _encode("uint256", _seed(data) % 2),
+            _selector("getAssetPrice(address)"): lambda *_: _encode("uint256", 10**18),
+            _selector("getAssetsPrices(address[])"): self._assets_prices,
+            _selector("decimals()"): lambda *_: _encode("uint8", 18),
+            _selector("symbol()"): lambda *_: _encode("string", "TKN"),
+            _selector("ADDRESSES_PROVIDER()"): lambda *_: _encode("address", "0x" + "11" * 20),
+            _selector("getAddressesProvider()"): lambda *_: _encode("address", "0x" + "11" * 20),
+            _selector("getPriceOracle()"): lambda *_: _encode("address", "0x" + "11" * 20),
+            _selector("BASE_CURRENCY_UNIT()"): lambda *_: _encode("uint256", 10**8),
+            _selector("getReservesList()"): lambda *_: _encode("address[]", [r[0] for r in RESERVES]),
+            _selector("getReserveData(address)"): self._reserve_data,
+            _selector("getEModeCategoryData(uint8)"): self._emode_category_data,
+            _selector("getUserConfiguration(address)"): lambda _, data: _encode("(uint256)", (_config(_seed(data)),)),
+            _selector("aggregate3((address,bool,bytes)[])"): self._aggregate3,
+        }
+
+    def user(self, idx: int) -> str:
+        """Get address of the i-th holder"""
+        return "0x" + keccak(text=str(idx))[:20].hex()
+
+    def handle(self, request: dict[str, Any]) -> dict[str, Any]:
+        """Answer the JSON-RPC request"""
+
+        self.counters.inc("requests")
+        method, params = request["method"], request.get("params", [])
+        if method == "eth_chainId":
+            result: Any = hex(self.chain_id)
+        elif method == "net_version":
+            result = str(self.chain_id)
+        elif method == "eth_blockNumber":
+            result = hex(HEAD)
+        elif method == "eth_getBlockByNumber":
+            result = self._block(HEAD if params[0] == "latest" else int(params[0], 16))
+        elif method == "eth_getLogs":
+            result = self._logs(params[0])
+        elif method == "eth_call":
+            result = "0x" + self._call(params[0]["to"], bytes.fromhex(params[0]["data"][2:])).hex()
+        else:
+            return {"jsonrpc": "2.0", "id": request["id"], "error": {"code": -32601, "message": f"{method} not found"}}
+        return {"jsonrpc": "2.0", "id": request["id"], "result": result}
+
+    def _call(self, to: str, data: bytes) -> bytes:
+        method = self.methods.get(data[:4])
+        if method is None:
+            raise ValueError(f"Unknown selector 0x{data[:4].hex()}")
+        if method != self._aggregate3:  # pylint: disable=comparison-with-callable
+            self.counters.inc("calls")
+        return method(to.lower(), data[4:])
+
+    def _aggregate3(self, _: str, data: bytes) -> bytes:
+        (calls,) = decode_abi(["(address,bool,bytes)[]"], data)
+        return _encode("(bool,bytes)[]", [(True, self._call(to, call)) for to, _, call in calls])
+
+    def _balance_of(self, token: str, data: bytes) -> bytes:
+        seed = _seed(data)
+        if token in RESERVE_TOKENS:
+            balance = 0 if token in STABLE_DEBT_TOKENS else ((seed * 7 + int(token[-2:], 16)) % 100) * 10**17
+        else:
+            balance = (seed % 100) * 10**17
+        return _encode("uint256", balance)
+
+    def _user_account_data(self, _: str, data: bytes) -> bytes:
+        seed = _seed(data)
+        config, emode = _config(seed), seed % 2
+        collateral = debt = threshold = ltv = 0
+        for idx, (_, a_token, _, var, price, reserve_threshold, reserve_ltv) in enumerate(RESERVES):
+            if config >> (2 * idx + 1) & 1:
+                value = ((seed * 7 + int(a_token[-2:], 16)) % 100) * 10**17 * price // 10**18
+                collateral += value
+                threshold += value * (9300 if emode else reserve_threshold)
+                ltv += value * (9000 if emode else reserve_ltv)
+            if config >> (2 * idx) & 1:
+                debt += ((seed * 7 + int(var[-2:], 16)) % 100) * 10**17 * price // 10**18
+
+        healthf = threshold * 10**18 // 10000 // debt if debt else 2**256 - 1
+        threshold, ltv = (threshold // collateral, ltv // collateral) if collateral else (0, 0)
+        return encode_abi(["uint256"] * 6, [collateral, debt, 0, threshold, ltv, healthf])
+
+    def _assets_prices(self, _: str, data: bytes) -> bytes:
+        (assets,) = decode_abi(["address[]"], data)
+        prices = {r[0]: r[4] for r in RESERVES}
+        return _encode("uint256[]", [prices.get(a.lower(), 10**8) for a in assets])
+
+    def _reserve_data(self, _: str, data: bytes) -> bytes:
+        (asset,) = decode_abi(["address"], data)
+        idx = [r[0] for r in RESERVES].index(asset.lower())
+        _, a_token, stable, var, _, threshold, ltv = RESERVES[idx]
+        config = ltv | threshold << 16 | 10500 << 32 | 18 << 48 | 1 << 168
+        return _encode(
+            "((uint256),uint128,uint128,uint128,uint128,uint128,uint40,uint16,"
+            "address,address,address,address,uint128,uint128,uint128)",
+            ((config,), 0, 0, 0, 0, 0, 0, idx, a_token, stable, var, ZERO_ADDRESS, 0, 0, 0),
+        )
+
+    def _emode_category_data(self, *_: Any) -> bytes:
+        return _encode("(uint16,uint16,uint16,address,string)", (9000, 9300, 10100, ZERO_ADDRESS, "ETH"))
+
+    def _logs(self, params: dict[str, Any]) -> list[dict[str, Any]]:
+        topics = params.get("topics") or []
+        if not topics or topics[0] != TRANSFER_TOPIC:
+            return []  # the pool emits no events after the transfers
+
+        from_block, to_block = int(params["fromBlock"], 16), int(params["toBlock"], 16)
+        first = max(-(-(from_block - self.first_block) // TRANSFERS_STEP), 0)
+        last = min((to_block - self.first_block) // TRANSFERS_STEP, self.holders - 1)
+        address = params["address"][0] if isinstance(params["address"], list) else params["address"]
+
+        logs = []
+        for idx in range(first, last + 1):
+            logs.append(
+                {
+                    "address": address,
+                    "topics": [TRANSFER_TOPIC, ZERO_WORD, "0x" + "00" * 12 + self.user(idx)[2:]],
+                    "data": "0x" + "00" * 31 + "01",
+                    "blockNumber": hex(self.first_block + idx * TRANSFERS_STEP),
+                    "blockHash": ZERO_WORD,
+                    "transactionHash": ZERO_WORD,
+                    "transactionIndex": "0x0",
+                    "logIndex": "0x0",
+                    "removed": False,
+                }
+            )
+        self.counters.inc("logs", len(logs))
+        return logs
+
+    def _block(self, number: int) -> dict[str, Any]:
+        return {
+            "number": hex(number),
+            "timestamp": hex(TIMESTAMP + (number - HEAD) * 12),
+            "hash": ZERO_WORD,
+            "parentHash": ZERO_WORD,
+            "nonce": "0x" + "00" * 8,
+            "sha3Uncles": ZERO_WORD,
+            "logsBloom": "0x" + "00" * 256,
+            "transactionsRoot": ZERO_WORD,
+            "stateRoot": ZERO_WORD,
+            "receiptsRoot": ZERO_WORD,
+            "miner": ZERO_ADDRESS,
+            "difficulty": "0x0",
+            "totalDifficulty": "0x0",
+            "extraData": "0x",
+            "size": "0x0",
+            "gasLimit": "0x0",
+            "gasUsed": "0x0",
+            "transactions": [],
+            "uncles": [],
+        }
+
+
+def _selector(signature: str) -> bytes:
+    return function_signature_to_4byte_selector(signature)
+
+
+def _encode(abi_type: str, value: Any) -> bytes:
+    return encode_abi([abi_type], [value])
+
+
+def _seed(data: bytes) -> int:
+    """Get the seed of the user by the last bytes of the address argument"""
+    return int.from_bytes(data[28:32], "big")
+
+
+def _config(seed: int) -> int:
+    """Get bitmask of the reserves the user supplies (odd bits) and borrows (even bits)"""
+    return 2 | (8 if seed % 3 == 0 else 0) | (4 if seed % 2 == 0 else 0)
+
+
+def make_handler(chain: Chain, latency: float, error_rate: float) -> type[BaseHTTPRequestHandler]:
+    """Get handler of the HTTP requests which delays every request and fails the share of them with 503 status"""
+
+    rng = random.Random(0)
+
+    class Handler(BaseHTTPRequestHandler):
+        """JSON-RPC over HTTP handler"""
+
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *_: Any) -> None:  # pylint: disable=arguments-differ
+            pass
+
+        def do_GET(self) -> None:  # pylint: disable=invalid-name
+            """Layout of the chain and the counters"""
+            self._respond(
+                200,
+                {
+                    "chain_id": chain.chain_id,
+                    "head": HEAD,
+                    "first_block": chain.first_block,
+                    "holders": chain.holders,
+                    **chain.counters.values,
+                },
+            )
+
+        def do_POST(self) -> None:  # pylint: disable=invalid-name
+            """JSON-RPC request or batch"""
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            if latency:
+                time.sleep(latency)
+            if error_rate and rng.random() < error_rate:
+                chain.counters.inc("errors")
+                self._respond(503, None)
+                return
+            self._respond(200, [chain.handle(r) for r in body] if isinstance(body, list) else chain.handle(body))
+
+        def _respond(self, status: int, payload: Any) -> None:
+            content = json.dumps(payload).encode() if payload is not None else b""
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+    return Handler
+
+
+def main() -> None:
+    """Serve the synthetic chain until interrupted"""
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=8545)
+    parser.add_argument("--chain-id", type=int, default=1)
+    parser.add_argument("--holders", type=int, default=1000, help="number of the aToken holders")
+    parser.add_argument("--latency", type=float, default=0, help="delay of every HTTP request (in seconds)")
+    parser.add_argument("--error-rate", type=float, default=0, help="share of HTTP requests failed with 503 status")
+    args = parser.parse_args()
+
+    chain = Chain(args.chain_id, args.holders)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(chain, args.latency, args.error_rate))
+    server.daemon_threads = True
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
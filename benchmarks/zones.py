@@ -0,0 +1,121 @@
+"""Benchmark of the risk zones bucketing on random positions.
+
+The vectorized bucketing of `get_risks` and the aggregation of `get_distr` are compared against the former
+per-row comparisons and pivot table, the distributions of both are checked to be the same."""
+
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+import numpy as np
+import pandas as pd
+
+THRESHOLDS = (1.42, 1.21, 1.14, 1.07, 1.03, 1.00)
+
+
+def make_frame(rows: int, seed: int) -> pd.DataFrame:
+    """Get prepared positions with health factors spread around the zones thresholds"""
+
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        {
+            "healthf": rng.lognormal(mean=0.2, sigma=0.3, size=rows),
+            "amount": rng.pareto(1.5, size=rows) * 10,
+            "supply_price": np.full(rows, 1800.0),
+        }
+    )
+
+
+def get_risk_labels_loop(df: pd.DataFrame, ratio_list: tuple[float, ...]) -> list[Any]:
+    """Zones of the positions by the chained comparisons of every health factor, the former implementation"""
+
+    return [
+        (x > ratio_list[0] and "A")
+        or (ratio_list[1] < x <= ratio_list[0] and "B+")
+        or (ratio_list[2] < x <= ratio_list[1] and "B")
+        or (ratio_list[3] < x <= ratio_list[2] and "B-")
+        or (ratio_list[4] < x <= ratio_list[3] and "C")
+        or (ratio_list[5] < x <= ratio_list[4] and "D")
+        or (ratio_list[5] <= x and "liquidation")
+        for x in df["healthf"]
+    ]
+
+
+def get_distr_loop(df: pd.DataFrame, ratio_list: tuple[float, ...]) -> pd.DataFrame:
+    """Former `get_risks` followed by `get_distr` built on the pivot table"""
+
+    df = df.copy()
+    df["risk_rating"] = get_risk_labels_loop(df, ratio_list)
+    df.query("amount > 0", inplace=True)
+    df.sort_values(by="healthf", ascending=False, inplace=True)
+
+    risk_distr = df.pivot_table(index="risk_rating", values="amount", aggfunc=["sum", "count"])
+    risk_distr.columns = pd.Index(("asset", "cnt"))
+    return risk_distr
+
+
+def best_of(repeat: int, fn: Callable[[], Any]) -> float:
+    """Get the shortest wall time of the function runs"""
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def run(rows: int, repeat: int, seed: int) -> dict[str, float]:
+    """Measure both implementations on a frame of the given number of rows"""
+
+    # the bot is configured by the environment on import
+    os.environ.setdefault("NODE_ENDPOINT", "http://127.0.0.1:8545")
+    # pylint: disable=import-outside-toplevel,protected-access
+    from bot.analytics import RISK_LABELS, _get_risk_codes, get_distr, get_risks
+
+    df = make_frame(rows, seed)
+    healthf = df["healthf"].to_numpy(dtype=float)
+
+    expected = get_distr_loop(df, THRESHOLDS)
+    actual = get_distr(get_risks(df, THRESHOLDS))
+    expected = expected.reindex([label for label in RISK_LABELS if label in expected.index])
+    if not np.allclose(actual["asset"], expected["asset"]) or list(actual["cnt"]) != list(expected["cnt"]):
+        raise AssertionError(f"Distributions differ at {rows} rows:\n{actual}\n{expected}")
+
+    results = {
+        "zones_loop_seconds": best_of(repeat, lambda: get_risk_labels_loop(df, THRESHOLDS)),
+        "zones_vectorized_seconds": best_of(repeat, lambda: _get_risk_codes(healthf, THRESHOLDS)),
+        "distr_loop_seconds": best_of(repeat, lambda: get_distr_loop(df, THRESHOLDS)),
+        "distr_vectorized_seconds": best_of(repeat, lambda: get_distr(get_risks(df, THRESHOLDS))),
+    }
+    results["zones_speedup"] = results["zones_loop_seconds"] / results["zones_vectorized_seconds"]
+    results["distr_speedup"] = results["distr_loop_seconds"] / results["distr_vectorized_seconds"]
+    return results
+
+
+def main() -> None:
+    """Run the benchmark for every frame size"""
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000], help="sizes of the frames")
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs to take the shortest one of")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random positions")
+    parser.add_argument("--out", help="path to write the results to as JSON")
+    args = parser.parse_args()
+
+    results = {
+        "params": {"repeat": args.repeat, "seed": args.seed},
+        "rows": {str(rows): run(rows, args.repeat, args.seed) for rows in args.rows},
+    }
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.out:
+        Path(args.out).write_text(output + "\n", encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
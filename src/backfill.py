@@ -0,0 +1,42 @@
+"""Backfill of the collaterals distributions at the past blocks to calibrate the zones thresholds"""
+
+import argparse
+import logging
+
+import pandas as pd
+
+from bot import worker
+from bot.backfill import COLUMNS, backfill, write_frame
+
+log = logging.getLogger(__name__)
+
+
+def main() -> None:
+    """Parse the arguments and write the distributions of the worker to the file"""
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("worker", help="name of the worker defined in bot/worker.py, e.g. astETH")
+    parser.add_argument("--from-block", type=int, required=True)
+    parser.add_argument("--to-block", type=int, required=True)
+    parser.add_argument("--step", type=int, default=7200, help="number of blocks between the snapshots")
+    parser.add_argument("--concurrency", type=int, default=4, help="number of blocks read at once")
+    parser.add_argument("--out", default="backfill.parquet", help="path to .parquet or .csv file to write")
+    args = parser.parse_args()
+
+    w = getattr(worker, args.worker, None)
+    if not isinstance(w, worker.Worker):
+        parser.error(f"Unknown worker {args.worker}")
+
+    frames = [pd.DataFrame(columns=COLUMNS)]
+    try:
+        for df in backfill(w, args.from_block, args.to_block, args.step, args.concurrency):
+            frames.append(df)
+    finally:
+        # the blocks read so far are kept on interruption as well
+        df = pd.concat(frames, ignore_index=True)
+        write_frame(df, args.out)
+        log.info("%d rows up to the block %s are written to %s", len(df), df["block"].max(), args.out)
+
+
+if __name__ == "__main__":
+    main()
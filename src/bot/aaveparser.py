@@ -1,53 +1,75 @@
 """Module for parsing data from AAVE protocol contracts"""
 
 import logging
-from collections.abc import Iterable
+import math
+import time
+from collections import deque
+from collections.abc import Iterable, Sequence
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import TypeAlias
 
+import numpy as np
 import pandas as pd
 from unsync import unsync
-from web3.types import BlockData, BlockIdentifier
-
-from .config import TRANSFER_EVENTS_BATCH
-from .eth import w3
-from .structs import Context, ERC20Like, PoolPosition, UserInfo
+from web3.types import BlockData, BlockIdentifier, EventData
+
+from .config import (
+    TRANSFER_EVENTS_BATCH,
+    TRANSFER_EVENTS_BATCH_MAX,
+    TRANSFER_EVENTS_BATCH_MIN,
+    TRANSFER_EVENTS_CONCURRENCY,
+)
+from .consts import LOGS_RESPONSE_FAST_SECONDS, LOGS_RESPONSE_SPARSE_COUNT
+from .eth import get_web3, is_logs_range_error
+from .healthf import get_engine
+from .metrics import TRANSFER_EVENTS_BATCH_SIZE
+from .positions import Prices, get_prices, select_users_to_refresh, update_positions
+from .storage import holders_store
+from .structs import AddressSet, ChainId, Context, PoolPosition, UserInfo
 
 log = logging.getLogger(__name__)
 
 
 UserAndBalance: TypeAlias = tuple[str, float]
 
+# 10k blocks per batch is compatible with the most of the providers, L2s produce blocks more often
+TRANSFER_EVENTS_BATCH_BY_CHAIN = {
+    ChainId.HOMESTEAD: 10_000,
+    ChainId.OPTIMISM: 100_000,
+    ChainId.POLYGON: 50_000,
+    ChainId.ARBITRUM: 100_000,
+}
 
-@unsync
-def get_user_stats(ctx: Context, pair: PoolPosition, user: str) -> UserInfo:
-    """Parse user stat from AAVE Lending Pool"""
-    return pair.amm.get_user_info(user, ctx.curr_block)
 
+def get_block_info(chain_id: int, block: BlockIdentifier = "latest") -> BlockData:
+    """Get the given block information"""
+    return get_web3(chain_id).eth.get_block(block)
 
-@unsync
-def get_atoken_balance(ctx: Context, a_token: ERC20Like, user: str) -> float:
-    """Get user's aToken balance"""
-    return a_token.balance(user, ctx.curr_block)
 
+def get_latest_block_number(chain_id: int) -> int:
+    """Get the latest block number of the chain"""
+    return get_web3(chain_id).eth.block_number
 
-@unsync
-def get_debt(ctx: Context, pair: PoolPosition, user: str) -> float:
-    """Get balance of user from AAVE tokens contracts"""
-    return pair.get_total_debt(user, ctx.curr_block)
 
+def restore_context(ctx: Context, pair: PoolPosition) -> None:
+    """Load holders and the blocks cursor from the persistent store"""
 
-def get_block_info(block: BlockIdentifier = "latest") -> BlockData:
-    """Get the given block information"""
-    return w3.eth.get_block(block)
+    if holders_store is None:
+        return
 
+    block, holders = holders_store.load(pair.key)
+    if block <= ctx.init_block:
+        return
 
-def get_latest_block_number() -> int:
-    """Get the latest ETH block number"""
-    return w3.eth.block_number
+    for holder in holders:
+        ctx.holders.add(holder)
+    ctx.init_block = block
+    log.info("Restored %d holders of %s up to the block %d", len(holders), pair.key, block)
 
 
-def find_new_atoken_holders(ctx: Context, pair: PoolPosition) -> None:
-    """Fetch AToken holders onchain"""
+def find_new_atoken_holders(ctx: Context, pair: PoolPosition) -> AddressSet:
+    """Fetch AToken holders onchain, returns all the addresses found in the blocks range.
+    Batches are fetched concurrently but merged in order, so the stored cursor never skips a range."""
 
     log.info(
         "Fetching %s holders within the blocks range %d,%d",
@@ -55,109 +77,177 @@ def find_new_atoken_holders(ctx: Context, pair: PoolPosition) -> None:
         ctx.init_block,
         ctx.curr_block,
     )
-    block = ctx.init_block
-    while block <= ctx.curr_block:
-        args = {
-            "fromBlock": block,
-            "toBlock": block + TRANSFER_EVENTS_BATCH,
-        }
-        events = pair.supply_token.a_token.events.Transfer.getLogs(**args)
-        for event in events:
-            ctx.holders.add(event["args"]["from"])
-            ctx.holders.add(event["args"]["to"])
-        block += TRANSFER_EVENTS_BATCH
-
-
-def get_holders_balances(ctx: Context, pair: PoolPosition) -> Iterable[tuple[str, float]]:
+    if not ctx.logs_batch:
+        ctx.logs_batch = TRANSFER_EVENTS_BATCH or TRANSFER_EVENTS_BATCH_BY_CHAIN.get(pair.chain_id, 10_000)
+
+    pool = ThreadPoolExecutor(max_workers=TRANSFER_EVENTS_CONCURRENCY, thread_name_prefix="logs")
+    pending: deque[tuple[int, int, Future]] = deque()
+    touched = AddressSet()
+
+    def submit(from_block: int, to_block: int) -> tuple[int, int, Future]:
+        return from_block, to_block, pool.submit(_get_transfer_logs, pair, from_block, to_block)
+
+    try:
+        block = ctx.init_block
+        while block <= ctx.curr_block or pending:
+            while block <= ctx.curr_block and len(pending) < TRANSFER_EVENTS_CONCURRENCY:
+                to_block = min(block + ctx.logs_batch - 1, ctx.curr_block)
+                pending.append(submit(block, to_block))
+                block = to_block + 1
+
+            from_block, to_block, future = pending.popleft()
+            try:
+                events, elapsed = future.result()
+            except Exception as ex:  # pylint: disable=broad-except
+                if not is_logs_range_error(ex) or to_block - from_block < TRANSFER_EVENTS_BATCH_MIN:
+                    raise
+                ctx.logs_batch = max(min(ctx.logs_batch, (to_block - from_block + 1) // 2), TRANSFER_EVENTS_BATCH_MIN)
+                TRANSFER_EVENTS_BATCH_SIZE.labels(pair.name).set(ctx.logs_batch)
+                log.warning("Logs request has been rejected, shrink the blocks range to %d: %s", ctx.logs_batch, ex)
+                # split the failed range and put it in front of the queue to keep the order
+                middle = (from_block + to_block) // 2
+                pending.appendleft(submit(middle + 1, to_block))
+                pending.appendleft(submit(from_block, middle))
+                continue
+
+            is_full_range = to_block - from_block + 1 >= ctx.logs_batch
+            is_fast = elapsed < LOGS_RESPONSE_FAST_SECONDS
+            if is_full_range and is_fast and len(events) < LOGS_RESPONSE_SPARSE_COUNT:
+                # grow slower than shrink to avoid hitting the provider's limit too often
+                ctx.logs_batch = min(ctx.logs_batch + ctx.logs_batch // 4, TRANSFER_EVENTS_BATCH_MAX)
+            TRANSFER_EVENTS_BATCH_SIZE.labels(pair.name).set(ctx.logs_batch)
+
+            found = AddressSet()
+            for event in events:
+                found.add(event["args"]["from"])
+                found.add(event["args"]["to"])
+            ctx.holders.update(found)
+            touched.update(found)
+            if holders_store is not None:
+                holders_store.save(pair.key, to_block, found)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    return touched
+
+
+def _get_transfer_logs(pair: PoolPosition, from_block: int, to_block: int) -> tuple[list[EventData], float]:
+    """Get AToken Transfer events within the blocks range and the time spent"""
+
+    started = time.monotonic()
+    events = pair.supply_token.a_token.events.Transfer.getLogs(fromBlock=from_block, toBlock=to_block)
+    return list(events), time.monotonic() - started
+
+
+def get_holders_balances(ctx: Context, pair: PoolPosition, holders: Sequence[str]) -> Iterable[UserAndBalance]:
     """Get balances of AToken holders"""
-    tasks = [(h, get_atoken_balance(ctx, pair.supply_token.a_token, h)) for h in ctx.holders]
-    for holder, task in tasks:
-        balance = task.result()  # type: ignore
-        yield (holder, balance)
+    return zip(holders, pair.get_total_supplies(holders, ctx.curr_block))
 
 
 def drop_users_below_threshold(
-    ctx: Context, threshold: float, users_and_balances: Iterable[UserAndBalance]
+    ctx: Context, pair: PoolPosition, users_and_balances: Iterable[UserAndBalance]
 ) -> Iterable[UserAndBalance]:
     """Drop users with balance below the threshold"""
+    dropped = []
     for user, balance in users_and_balances:
-        if balance < threshold:
+        if math.isnan(balance):
+            log.warning("Unable to get balance of %s, skip the user", user)
+            continue
+        if balance < pair.balance_threshold:
             ctx.holders.remove(user)
+            dropped.append(user)
             continue
         yield (user, balance)
 
+    if holders_store is not None and dropped:
+        holders_store.discard(pair.key, dropped)
+
 
 def fetch(ctx: Context, pair: PoolPosition) -> pd.DataFrame | None:
     """Fetch required blockchain data"""
 
-    latest_block = get_latest_block_number()
+    latest_block = get_latest_block_number(pair.chain_id)
     if latest_block == ctx.init_block:
         log.info("Block %d has been already read", latest_block)
         return None
 
     ctx.curr_block = latest_block
 
-    find_new_atoken_holders(ctx, pair)
-    buf = get_holders_balances(ctx, pair)
-    buf = drop_users_below_threshold(ctx, pair.balance_threshold, buf)  # NOTE: is there a better place for threshold?
+    touched = find_new_atoken_holders(ctx, pair)
+    df = read_positions(ctx, pair, touched)
 
-    df = pd.DataFrame(buf, columns=["user", "amount"])
+    # move context's blocks forward
+    ctx.init_block = ctx.curr_block
 
     if df.empty:
-        ctx.init_block = ctx.curr_block
         log.info("No holders found")
         return None
 
     log.info("%d holders found", len(df))
-    df.set_index("user")
+    return df
 
-    @unsync
-    def _get_stats():
 
-        buf = []
-        tasks = [(user, get_user_stats(ctx, pair, user)) for user in df["user"]]
-        for user, task in tasks:
-            stat: UserInfo = task.result()  # type: ignore
-            buf.append({"user": user, **stat})
-        return buf
+def read_positions(ctx: Context, pair: PoolPosition, touched: AddressSet) -> pd.DataFrame:
+    """Read positions of the known holders at the current block of the context.
+    Positions cached by the previous cycles are only re-read for the users touched since then."""
 
-    @unsync
-    def _get_debt():
+    prices = get_prices(ctx, pair)
+    engine = get_engine(ctx, pair)
+    if engine is not None and engine.refresh_reserves(ctx.curr_block):
+        ctx.positions = None  # re-read all the positions once the pool has got new reserves
+    holders, full = select_users_to_refresh(ctx, pair, touched)
+
+    buf = get_holders_balances(ctx, pair, holders)
+    buf = drop_users_below_threshold(ctx, pair, buf)
 
-        buf = []
-        tasks = [(user, get_debt(ctx, pair, user)) for user in df["user"]]
-        for user, task in tasks:
-            debt: float = task.result()  # type: ignore
-            buf.append({"user": user, "borrowed": debt})
-        return buf
+    df = pd.DataFrame(buf, columns=["user", "amount"])
+    users = df["user"].tolist()
 
     @unsync
-    def _get_extra_amount():
+    def _get_stats():
+        if engine is not None:
+            engine.update_users(users, ctx.curr_block, full)
+            return engine.users_info(users)
+        return pair.amm.get_users_info(users, ctx.curr_block)
 
-        prices = tuple(pair.get_token_price(t.address, ctx.curr_block) for t in pair.extra_tokens)
+    @unsync
+    def _get_debt():
+        return pair.get_total_debts(users, ctx.curr_block)
 
-        @unsync
-        def balances(user: str) -> tuple[float, ...]:
-            return tuple(t.a_token.balance(user, ctx.curr_block) for t in pair.extra_tokens)
+    @unsync
+    def _get_extra_balances():
+        return [t.a_token.balances(users, ctx.curr_block) for t in pair.extra_tokens]
 
-        buf = []
-        tasks = [(user, balances(user)) for user in df["user"]]
-        for user, task in tasks:
-            user_balances: tuple[float, ...] = task.result()  # type: ignore
-            extra_amount = sum(b * p for b, p in zip(user_balances, prices))
-            buf.append({"user": user, "extra_amount": extra_amount})
-        return buf
+    tasks = [_get_stats(), _get_debt(), _get_extra_balances()]
+    stats, debts, extra_balances = [task.result() for task in tasks]  # type: ignore # pylint: disable=no-member
 
-    tasks = [_get_stats(), _get_debt(), _get_extra_amount()]
-    parts = [pd.DataFrame(task.result()) for task in tasks]  # type: ignore # pylint: disable=no-member
+    df = assemble_frame(df, stats, debts, extra_balances, prices)
+    df = update_positions(ctx, pair, df, extra_balances, prices, full)
+    if engine is not None:
+        df = engine.apply(df)
+        engine.verify(pair, df, ctx.curr_block)
 
-    df["supply_price"] = pair.get_supply_token_price(ctx.curr_block)
-    df["debt_price"] = pair.get_debt_token_price(ctx.curr_block)
+    return df
 
-    for part in parts:
-        df = df.merge(part, on="user", how="left")
 
-    # move context's blocks forward
-    ctx.init_block = ctx.curr_block
+def assemble_frame(
+    df: pd.DataFrame,
+    stats: Sequence[UserInfo],
+    debts: Sequence[float],
+    extra_balances: Sequence[Sequence[float]],
+    prices: Prices,
+) -> pd.DataFrame:
+    """Join results of the fetching stages with the users and amounts frame.
+    All the stages return values aligned with the users of the frame, so the columns are assembled by position."""
+
+    extra_amount = np.zeros(len(df))
+    for balances, price in zip(extra_balances, prices.extra):
+        extra_amount += np.asarray(balances, dtype=float) * price
+
+    df["supply_price"] = prices.supply
+    df["debt_price"] = prices.debt
+    df = pd.concat([df, pd.DataFrame(list(stats), columns=list(UserInfo.__annotations__), index=df.index)], axis=1)
+    df["borrowed"] = np.asarray(debts, dtype=float)
+    df["extra_amount"] = extra_amount
 
     return df
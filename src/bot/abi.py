@@ -16,3 +16,4 @@ PoolAddressesProvider = load_abi("PoolAddressesProvider.json")
 LendingPool = load_abi("LendingPool.json")
 Oracle = load_abi("Oracle.json")
 ERC20 = load_abi("ERC20.json")
+Multicall3 = load_abi("Multicall3.json")
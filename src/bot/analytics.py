@@ -1,8 +1,10 @@
 """Analytics methods"""
 
 import logging
+from collections.abc import Iterable, Sequence
 from typing import Callable, NamedTuple, TypeAlias
 
+import numpy as np
 import pandas as pd
 
 log = logging.getLogger(__name__)
@@ -17,7 +19,8 @@ Thresholds: TypeAlias = tuple[
     float,
 ]
 
-Filter: TypeAlias = Callable[[pd.DataFrame], pd.DataFrame] | str
+# boolean mask of the positions in the bin or a query string
+Filter: TypeAlias = Callable[[pd.DataFrame], pd.Series] | str
 Bin: TypeAlias = tuple[Thresholds, Filter]
 
 
@@ -31,6 +34,56 @@ class RisksResult(NamedTuple):
 RISK_LABELS = ["A", "B+", "B", "B-", "C", "D", "liquidation"]
 
 
+class Shock(NamedTuple):
+    """Relative changes of the supply and debt token prices, e.g. -0.05 for -5%"""
+
+    supply: float
+    debt: float
+
+
+class LiquidationIndex:
+    """Collateral amounts of the positions by the supply/debt price ratio the positions get liquidated at.
+
+    The liquidation ratio is the one the health factor of the position drops to 1 at, provided the supply token
+    is the only asset of the position changing its value in terms of the debt token. The ratios are kept sorted
+    along with the cumulative amounts, so every query is a binary search."""
+
+    def __init__(self, ratio: float, liquidation_ratios: np.ndarray, amounts: np.ndarray) -> None:
+        order = np.argsort(liquidation_ratios, kind="stable")
+        self.ratio = ratio  # current supply/debt price ratio
+        self.ratios = liquidation_ratios[order]
+        self.cumulative = np.cumsum(amounts[order])
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "LiquidationIndex":
+        """Build the index of the prepared positions"""
+
+        df = df.query("amount > 0 and healthf > 0")
+        if df.empty or not _get_debt_price(df):
+            return cls(0.0, np.zeros(0), np.zeros(0))
+
+        supply_value = df["amount"] * df["supply_price"]
+        # the supply token value has to lose the excess of the collateral over the liquidation level
+        share = 1 - df["collateral"] * (1 - 1 / df["healthf"]) / supply_value
+        ratio = _get_supply_price(df) / _get_debt_price(df)
+        return cls(
+            ratio,
+            np.clip(share.to_numpy(dtype=float), 0, None) * ratio,
+            df["amount"].to_numpy(dtype=float),
+        )
+
+    @property
+    def total(self) -> float:
+        """Get collateral amount of all the positions"""
+        return float(self.cumulative[-1]) if len(self.cumulative) else 0.0
+
+    def at_risk(self, ratio: float) -> float:
+        """Get collateral amount liquidatable once the supply/debt price ratio drops to the given one"""
+
+        idx = int(np.searchsorted(self.ratios, ratio, side="left"))
+        return self.total - (float(self.cumulative[idx - 1]) if idx else 0.0)
+
+
 def prepare_data(df: pd.DataFrame) -> pd.DataFrame:
     """Transform raw data received"""
 
@@ -55,16 +108,8 @@ def get_risks(df: pd.DataFrame, ratio_list: Thresholds) -> pd.DataFrame:
 
     df = df.copy()
 
-    df["risk_rating"] = [
-        (x > ratio_list[0] and "A")
-        or (ratio_list[1] < x <= ratio_list[0] and "B+")
-        or (ratio_list[2] < x <= ratio_list[1] and "B")
-        or (ratio_list[3] < x <= ratio_list[2] and "B-")
-        or (ratio_list[4] < x <= ratio_list[3] and "C")
-        or (ratio_list[5] < x <= ratio_list[4] and "D")
-        or (ratio_list[5] <= x and "liquidation")
-        for x in df["healthf"]
-    ]
+    codes = _get_risk_codes(df["healthf"].to_numpy(dtype=float), ratio_list)
+    df["risk_rating"] = pd.Categorical.from_codes(codes, categories=RISK_LABELS)
 
     df.query("amount > 0", inplace=True)
     df.sort_values(by="healthf", ascending=False, inplace=True)
@@ -72,12 +117,26 @@ def get_risks(df: pd.DataFrame, ratio_list: Thresholds) -> pd.DataFrame:
     return df
 
 
+def _get_risk_codes(healthf: np.ndarray, ratio_list: Thresholds) -> np.ndarray:
+    """Get indexes of RISK_LABELS by the health factors of any shape, -1 for the unrated ones"""
+
+    # the thresholds are descending, so the number of them below the health factor points to the zone from the end
+    bounds = np.array(ratio_list[::-1])
+    codes = len(bounds) - np.searchsorted(bounds, healthf, side="left")
+    # positions at the last threshold are liquidatable, the ones below it aren't rated
+    below = codes == len(bounds)
+    codes[below] = np.where(healthf[below] == bounds[0], len(bounds), -1)
+    codes[np.isnan(healthf)] = -1
+    return codes
+
+
 def get_distr(df: pd.DataFrame) -> pd.DataFrame:
-    """This function calculates and returns a pivot table by risk levels"""
+    """This function calculates and returns a table of the positions aggregated by risk levels"""
 
-    risk_distr = df.pivot_table(index="risk_rating", values="amount", aggfunc=["sum", "count"])
-    risk_distr.columns = pd.Index(("asset", "cnt"))
-    risk_distr["percent"] = (risk_distr["asset"] / risk_distr["asset"].sum()) * 100
+    amounts = df.groupby("risk_rating", observed=True)["amount"]
+    risk_distr = pd.DataFrame({"asset": amounts.sum(), "cnt": amounts.count()})
+    # unrated positions are out of the table but still count towards the total
+    risk_distr["percent"] = (risk_distr["asset"] / df["amount"].sum()) * 100
     risk_distr["value"] = risk_distr["asset"] * _get_supply_price(df)
 
     return risk_distr
@@ -92,26 +151,107 @@ def _get_supply_price(df: pd.DataFrame) -> float:
     return df["supply_price"].iloc[0]
 
 
-def _apply_df_query_filter(df: pd.DataFrame, filter_: Filter) -> pd.DataFrame:
-    """Apply filter to dataframe"""
+def _get_debt_price(df: pd.DataFrame) -> float:
+    """Get debt price from dataframe"""
+
+    if "debt_price" not in df:
+        return 0.0
+
+    return df["debt_price"].iloc[0]
+
+
+def _get_filter_mask(df: pd.DataFrame, filter_: Filter) -> pd.Series:
+    """Evaluate filter over dataframe"""
 
     if callable(filter_):
         return filter_(df)
 
-    df = df.copy()
-    df.query(filter_, inplace=True)
-
-    return df
+    return df.eval(filter_)
 
 
 def get_zones_values(df: pd.DataFrame, bin_: Bin) -> dict[str, RisksResult]:
-    """Calculate risk distribution.
-    Almost as is from related jupyter notebook."""
+    """Calculate risk distribution of the single bin over the prepared positions"""
+
+    return get_bins_values(df, [bin_])[0]
+
+
+def get_bins_values(df: pd.DataFrame, bins: Iterable[Bin]) -> list[dict[str, RisksResult]]:
+    """Calculate risk distribution for every bin.
+    Almost as is from related jupyter notebook, the positions are prepared once per cycle by `prepare_data`."""
+
+    return [_get_bin_values(df[_get_filter_mask(df, filter_)], thresholds) for thresholds, filter_ in bins]
+
+
+def get_liquidation_indexes(df: pd.DataFrame, bins: Iterable[Bin]) -> list[LiquidationIndex]:
+    """Build liquidation index of every bin over the prepared positions"""
+
+    return [LiquidationIndex.from_frame(df[_get_filter_mask(df, filter_)]) for _, filter_ in bins]
+
+
+def get_users_zones(df: pd.DataFrame, bins: Iterable[Bin]) -> pd.DataFrame:
+    """Get bin and zone of every user of the prepared positions selected to any of the bins,
+    the first bin of the user wins"""
+
+    frames = []
+    for idx, (thresholds, filter_) in enumerate(bins):
+        selected = df[_get_filter_mask(df, filter_)]
+        codes = _get_risk_codes(selected["healthf"].to_numpy(dtype=float), thresholds)
+        zones = pd.Categorical.from_codes(codes, categories=RISK_LABELS)
+        frames.append(pd.DataFrame({"user": selected["user"].to_numpy(), "bin": idx + 1, "zone": zones}))
+
+    if not frames:
+        return pd.DataFrame({"user": [], "bin": [], "zone": pd.Categorical([], categories=RISK_LABELS)})
+    return pd.concat(frames, ignore_index=True).drop_duplicates("user")
+
+
+def get_bins_stress_values(df: pd.DataFrame, bins: Iterable[Bin], shocks: Sequence[Shock]) -> list[np.ndarray]:
+    """Calculate risk distribution of every bin under every price shock.
+    Takes the prepared positions, returns amounts of the zones per bin as (shocks, zones) arrays,
+    the zones are ordered as RISK_LABELS."""
+
+    supply = np.array([s.supply for s in shocks], dtype=float)
+    debt = np.array([s.debt for s in shocks], dtype=float)
+    return [
+        _get_bin_stress_values(df[_get_filter_mask(df, filter_)], thresholds, supply, debt)
+        for thresholds, filter_ in bins
+    ]
+
+
+def _get_bin_stress_values(
+    df: pd.DataFrame,
+    thresholds: Thresholds,
+    supply: np.ndarray,
+    debt: np.ndarray,
+) -> np.ndarray:
+    """Calculate risk distribution of the positions selected to the bin over the users x shocks matrix.
+    Only the supply token collateral and the debt token debt change their values, the rest of the positions stays."""
+
+    df = df.query("amount > 0")
+    amount = df["amount"].to_numpy(dtype=float)
+    collateral = df["collateral"].to_numpy(dtype=float)
+    debt_value = df["debt"].to_numpy(dtype=float)
+    healthf = df["healthf"].to_numpy(dtype=float)
+
+    stressed_collateral = collateral[:, None] + (amount * df["supply_price"].to_numpy(dtype=float))[:, None] * supply
+    stressed_debt = debt_value[:, None] + (df["borrowed"] * df["debt_price"]).to_numpy(dtype=float)[:, None] * debt
+    with np.errstate(divide="ignore", invalid="ignore"):
+        stressed_healthf = healthf[:, None] * stressed_collateral / collateral[:, None] * debt_value[:, None]
+        stressed_healthf /= stressed_debt
+
+    codes = _get_risk_codes(stressed_healthf, thresholds)
+    # every shock gets its own range of the zones to sum the amounts by a single bincount
+    cells = codes + len(RISK_LABELS) * np.arange(len(supply))
+    rated = codes >= 0
+    values = np.bincount(
+        cells[rated],
+        weights=np.broadcast_to(amount[:, None], codes.shape)[rated],
+        minlength=len(RISK_LABELS) * len(supply),
+    )
+    return values.reshape(len(supply), len(RISK_LABELS))
 
-    thresholds, filter_ = bin_
 
-    df = prepare_data(df)
-    df = _apply_df_query_filter(df, filter_)
+def _get_bin_values(df: pd.DataFrame, thresholds: Thresholds) -> dict[str, RisksResult]:
+    """Calculate risk distribution of the positions selected to the bin"""
 
     results: dict[str, RisksResult] = {label: RisksResult(0.0, 0.0) for label in RISK_LABELS}
     if df.empty:
@@ -0,0 +1,127 @@
+"""Asyncio based counterpart of aaveparser module.
+Reads are issued as coroutines on a single event loop with the shared connections pool."""
+
+import asyncio
+import logging
+import threading
+from functools import cache
+
+import pandas as pd
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+
+from .aaveparser import assemble_frame, drop_users_below_threshold, find_new_atoken_holders
+from .config import HTTP_ACCEPT_ENCODING, HTTP_POOL_BLOCK, HTTP_POOL_SIZE, RPC_MAX_IN_FLIGHT
+from .eth import get_async_web3
+from .healthf import get_engine
+from .positions import get_prices_async, select_users_to_refresh, update_positions
+from .providers import build_connections_trace
+from .structs import Context, ERC20Like, PoolPosition, UserInfo
+
+log = logging.getLogger(__name__)
+
+_setup_lock = threading.Lock()  # workers may fetch concurrently, the loop and the sessions are set up once
+
+
+def fetch(ctx: Context, pair: PoolPosition) -> pd.DataFrame | None:
+    """Fetch required blockchain data within the event loop"""
+    with _setup_lock:
+        _prepare_chain(pair.chain_id)
+    return asyncio.run_coroutine_threadsafe(fetch_async(ctx, pair), _get_loop()).result()
+
+
+async def fetch_async(ctx: Context, pair: PoolPosition) -> pd.DataFrame | None:
+    """Fetch required blockchain data"""
+
+    latest_block = await get_async_web3(pair.chain_id).eth.block_number  # type: ignore
+    if latest_block == ctx.init_block:
+        log.info("Block %d has been already read", latest_block)
+        return None
+
+    ctx.curr_block = latest_block
+
+    # logs scanning has its own bounded concurrency, so let it run in the threads
+    touched = await asyncio.to_thread(find_new_atoken_holders, ctx, pair)
+    await asyncio.to_thread(_resolve_metadata, pair)
+    prices = await get_prices_async(ctx, pair)
+    engine = get_engine(ctx, pair)
+    if engine is not None and await asyncio.to_thread(engine.refresh_reserves, ctx.curr_block):
+        ctx.positions = None  # re-read all the positions once the pool has got new reserves
+    holders, full = await asyncio.to_thread(select_users_to_refresh, ctx, pair, touched)
+
+    balances = await pair.get_total_supplies_async(holders, ctx.curr_block)
+    buf = drop_users_below_threshold(ctx, pair, zip(holders, balances))
+
+    df = pd.DataFrame(buf, columns=["user", "amount"])
+    users = df["user"].tolist()
+
+    async def _get_stats() -> list[UserInfo]:
+        if engine is None:
+            return await pair.amm.get_users_info_async(users, ctx.curr_block)
+        # the engine's reads are packed into a few multicalls, so run them in the threads
+        await asyncio.to_thread(engine.update_users, users, ctx.curr_block, full)
+        return engine.users_info(users)
+
+    stats, debts, *extra_balances = await asyncio.gather(
+        _get_stats(),
+        pair.get_total_debts_async(users, ctx.curr_block),
+        *(t.a_token.balances_async(users, ctx.curr_block) for t in pair.extra_tokens),
+    )
+
+    df = assemble_frame(df, stats, debts, extra_balances, prices)
+    df = update_positions(ctx, pair, df, extra_balances, prices, full)
+    if engine is not None:
+        df = engine.apply(df)
+        await asyncio.to_thread(engine.verify, pair, df, ctx.curr_block)
+
+    # move context's blocks forward
+    ctx.init_block = ctx.curr_block
+
+    if df.empty:
+        log.info("No holders found")
+        return None
+
+    log.info("%d holders found", len(df))
+    return df
+
+
+def _resolve_metadata(pair: PoolPosition) -> None:
+    """Warm up cached properties which require blocking calls to not block the event loop by them"""
+
+    tokens: tuple[ERC20Like, ...] = (pair.supply_token.a_token, pair.debt_token.stable, pair.debt_token.var)
+    tokens += tuple(t.a_token for t in pair.extra_tokens)
+    for token in tokens:
+        _ = token.precision
+    _ = pair.amm.base_precision
+
+
+@cache
+def _get_loop() -> asyncio.AbstractEventLoop:
+    """Get event loop running forever in a dedicated thread"""
+
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="asyncio", daemon=True).start()
+    return loop
+
+
+@cache
+def _prepare_chain(chain_id: int) -> None:
+    """Set up the chain's Web3 instance within the event loop"""
+    asyncio.run_coroutine_threadsafe(_setup_session(chain_id), _get_loop()).result()
+
+
+async def _setup_session(chain_id: int) -> None:
+    """Share a connections pool per endpoint between all the requests to the chain"""
+
+    provider = get_async_web3(chain_id).provider
+    for endpoint in provider.router.endpoints:  # type: ignore
+        session = ClientSession(
+            connector=TCPConnector(
+                limit=RPC_MAX_IN_FLIGHT,
+                limit_per_host=HTTP_POOL_SIZE if HTTP_POOL_BLOCK else 0,
+            ),
+            headers={"Accept-Encoding": HTTP_ACCEPT_ENCODING or "identity"},
+            timeout=ClientTimeout(total=90),
+            raise_for_status=True,
+            trace_configs=[build_connections_trace(endpoint.uri)],
+        )
+        await provider.cache_async_session(session, endpoint.uri)  # type: ignore
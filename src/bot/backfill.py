@@ -0,0 +1,69 @@
+"""Zones distributions of the workers at the past blocks"""
+
+import logging
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import pandas as pd
+
+from .aaveparser import find_new_atoken_holders, get_block_info, read_positions
+from .analytics import get_bins_values, prepare_data
+from .storage import holders_store
+from .structs import AddressSet, Context
+from .worker import Worker
+
+log = logging.getLogger(__name__)
+
+# columns of the frames returned by backfill, a row per zone of every bin at every block
+COLUMNS = ["block", "timestamp", "pair", "bin", "zone", "amount", "value"]
+
+
+def backfill(w: Worker, from_block: int, to_block: int, step: int, concurrency: int) -> Iterator[pd.DataFrame]:
+    """Get zones distributions of the worker's bins at every step-th block of the range in order of the blocks.
+
+    Holders are collected by a single pass over the transfer events advancing from block to block, while positions
+    are read from scratch for up to `concurrency` blocks at once. Requires an archive node."""
+
+    if holders_store is not None:
+        raise RuntimeError("Holders index of HOLDERS_DB_PATH follows the latest block, unset it to backfill")
+    if from_block < w.ctx.init_block:
+        raise ValueError(f"{from_block=} precedes the first block of the worker {w.ctx.init_block}")
+
+    ctx = Context(init_block=w.ctx.init_block)
+    pending: deque[Future] = deque()
+    with ThreadPoolExecutor(max(concurrency, 1), thread_name_prefix="backfill") as pool:
+        for block in range(from_block, to_block + 1, step):
+            ctx.curr_block = block
+            find_new_atoken_holders(ctx, w.pair)
+            ctx.init_block = block
+            pending.append(pool.submit(_read_block, w, block, AddressSet(ctx.holders)))
+
+            # keep collecting the holders while the earlier blocks are read
+            while len(pending) >= concurrency or (pending and pending[0].done()):
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
+def _read_block(w: Worker, block: int, holders: AddressSet) -> pd.DataFrame:
+    df = read_positions(Context(init_block=block, curr_block=block, holders=holders), w.pair, AddressSet())
+    timestamp = get_block_info(w.pair.chain_id, block)["timestamp"]
+    log.info("%d positions of %s at the block %d have been read", len(df), w.pair.name, block)
+
+    rows = []
+    if not df.empty:
+        for idx, values in enumerate(get_bins_values(prepare_data(df), w.bins)):
+            for zone, v in values.items():
+                rows.append((block, timestamp, w.pair.name, idx + 1, zone, v.amount, v.value))
+    return pd.DataFrame(rows, columns=COLUMNS)
+
+
+def write_frame(df: pd.DataFrame, path: str) -> None:
+    """Write the frame to Parquet file or CSV one by the extension of the path"""
+
+    if path.endswith(".csv"):
+        df.to_csv(path, index=False)
+    else:
+        df.to_parquet(path, index=False)
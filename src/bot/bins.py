@@ -1,37 +1,26 @@
-"""Bins for collaterals"""
+"""Bins for collaterals, every bin selects the positions by a boolean mask over the prepared frame"""
 
 import pandas as pd
 
 from .analytics import Bin
 
 
-def steth_bin1(df: pd.DataFrame) -> pd.DataFrame:
+def steth_bin1(df: pd.DataFrame) -> pd.Series:
     """AAVE users with >=80% collaterals - stETH and >=80% debt - ETH"""
 
-    df = df.copy()
+    return df.eval("diff_collateral < 0.2 and diff_debt < 0.2 and borrowed > 0")
 
-    df.query("diff_collateral < 0.2 and diff_debt < 0.2 and borrowed > 0", inplace=True)
 
-    return df
-
-
-def steth_bin2(df: pd.DataFrame) -> pd.DataFrame:
+def steth_bin2(df: pd.DataFrame) -> pd.Series:
     """AAVE users with stETH collateral and >=80% debt - not ETH"""
 
-    df = df.copy()
-
-    df.query("diff_debt >= 0.8", inplace=True)
+    return df.eval("diff_debt >= 0.8")
 
-    return df
 
-
-def steth_bin3(df: pd.DataFrame) -> pd.DataFrame:
+def steth_bin3(df: pd.DataFrame) -> pd.Series:
     """All the others AAVE users with stETH collateral"""
 
-    bin1_df = steth_bin1(df)
-    bin2_df = steth_bin2(df)
-
-    return pd.DataFrame(pd.concat([df, bin1_df, bin2_df]).drop_duplicates(keep=False))
+    return ~(steth_bin1(df) | steth_bin2(df))
 
 
 STETH: list[Bin] = [
@@ -50,46 +39,28 @@ STETH: list[Bin] = [
 ]
 
 
-def wsteth_bin1_1(df: pd.DataFrame) -> pd.DataFrame:
+def wsteth_bin1_1(df: pd.DataFrame) -> pd.Series:
     """Users with e-mode with >=80% collaterals - wstETH and >=80% debt - ETH"""
 
-    df = df.copy()
+    return df.eval("diff_collateral < 0.2 and diff_debt < 0.2 and borrowed > 0 and emode == 1")
 
-    df = df.query("diff_collateral < 0.2 and diff_debt < 0.2 and borrowed > 0 and emode == 1")
 
-    return df
-
-
-def wsteth_bin1_2(df: pd.DataFrame) -> pd.DataFrame:
+def wsteth_bin1_2(df: pd.DataFrame) -> pd.Series:
     """Users without e-mode and with >=80% of collateral - wstETH, and >= 80% of debt - ETH"""
 
-    df = df.copy()
-
-    df = df.query("diff_collateral < 0.2 and diff_debt < 0.2 and borrowed > 0 and emode == 0")
+    return df.eval("diff_collateral < 0.2 and diff_debt < 0.2 and borrowed > 0 and emode == 0")
 
-    return df
 
-
-def wsteth_bin2(df: pd.DataFrame) -> pd.DataFrame:
+def wsteth_bin2(df: pd.DataFrame) -> pd.Series:
     """AAVE users with wstETH collateral and >=80% debt - not ETH"""
 
-    df = df.copy()
-
-    df.query("diff_debt >= 0.8", inplace=True)
+    return df.eval("diff_debt >= 0.8")
 
-    return df
 
-
-def wsteth_bin3(df: pd.DataFrame) -> pd.DataFrame:
+def wsteth_bin3(df: pd.DataFrame) -> pd.Series:
     """All the others AAVE users with stETH collateral"""
 
-    others = (
-        wsteth_bin1_1(df),
-        wsteth_bin1_2(df),
-        wsteth_bin2(df),
-    )
-
-    return pd.DataFrame(pd.concat([df, *others]).drop_duplicates(keep=False))
+    return ~(wsteth_bin1_1(df) | wsteth_bin1_2(df) | wsteth_bin2(df))
 
 
 WSTETH: list[Bin] = [
@@ -112,46 +83,28 @@ WSTETH: list[Bin] = [
 ]
 
 
-def st_matic_bin1_1(df: pd.DataFrame) -> pd.DataFrame:
+def st_matic_bin1_1(df: pd.DataFrame) -> pd.Series:
     """Users with e-mode and with >=80% collateral - stMATIC and  >=80% debt - MATIC"""
 
-    df = df.copy()
-
-    df.query("diff_collateral <= 0.2 and diff_debt <= 0.2 and borrowed > 0 and emode == 2", inplace=True)
+    return df.eval("diff_collateral <= 0.2 and diff_debt <= 0.2 and borrowed > 0 and emode == 2")
 
-    return df
 
-
-def st_matic_bin1_2(df: pd.DataFrame) -> pd.DataFrame:
+def st_matic_bin1_2(df: pd.DataFrame) -> pd.Series:
     """Users without e-mode and with >=80% collateral - stMATIC and  >=80% debt - MATIC"""
 
-    df = df.copy()
-
-    df.query("diff_collateral <= 0.2 and diff_debt <= 0.2 and borrowed > 0 and emode != 2", inplace=True)
+    return df.eval("diff_collateral <= 0.2 and diff_debt <= 0.2 and borrowed > 0 and emode != 2")
 
-    return df
 
-
-def st_matic_bin2(df: pd.DataFrame) -> pd.DataFrame:
+def st_matic_bin2(df: pd.DataFrame) -> pd.Series:
     """AAVE users with stMATIC collateral and >=80% debt - not MATIC"""
 
-    df = df.copy()
-
-    df.query("diff_debt >= 0.8", inplace=True)
+    return df.eval("diff_debt >= 0.8")
 
-    return df
 
-
-def st_matic_bin3(df: pd.DataFrame) -> pd.DataFrame:
+def st_matic_bin3(df: pd.DataFrame) -> pd.Series:
     """All the others AAVE users with stMATIC collateral"""
 
-    others = (
-        st_matic_bin1_1(df),
-        st_matic_bin1_2(df),
-        st_matic_bin2(df),
-    )
-
-    return pd.DataFrame(pd.concat([df, *others]).drop_duplicates(keep=False))
+    return ~(st_matic_bin1_1(df) | st_matic_bin1_2(df) | st_matic_bin2(df))
 
 
 STMATIC: list[Bin] = [
@@ -1,69 +1,132 @@
 """Anchor protocol collaterals monitoring bot"""
 
 import logging
-import time
 from contextlib import suppress
 from pprint import PrettyPrinter
 
 import pandas as pd
 
-from .aaveparser import fetch
-from .analytics import get_zones_values
-from .config import MAIN_ERROR_COOLDOWN, PARSE_INTERVAL
-from .eth import w3
-from .metrics import APP_ERRORS, COLLATERALS, FETCH_DURATION, NETWORK, PROCESSING_COMPLETED, VALUES
-from .structs import ChainId
+from . import aaveparser, asyncparser
+from .aaveparser import restore_context
+from .analytics import (
+    RISK_LABELS,
+    Shock,
+    get_bins_stress_values,
+    get_bins_values,
+    get_liquidation_indexes,
+    get_users_zones,
+    prepare_data,
+)
+from .config import (
+    CHAIN_PARSE_INTERVALS,
+    FETCH_BACKEND,
+    LIQUIDATION_PRICE_STEPS,
+    MAIN_ERROR_COOLDOWN,
+    MAX_CONCURRENT_WORKERS,
+    PARSE_INTERVAL,
+    REFRESH_TRIGGER,
+    STRESS_DEBT_SHOCKS,
+    STRESS_SUPPLY_SHOCKS,
+    TRIGGER_POLL_INTERVAL,
+)
+from .consts import ChainId
+from .eth import get_chain_ids, get_web3
+from .metrics import (
+    APP_ERRORS,
+    COLLATERALS,
+    COLLATERALS_LIQUIDATABLE,
+    COLLATERALS_STRESSED,
+    FETCH_DURATION,
+    NETWORK,
+    PROCESSING_COMPLETED,
+    VALUES,
+)
+from .scheduler import Scheduler
+from .snapshots import snapshots_store
+from .trigger import get_trigger
 from .worker import Worker, arbwstETH, astETH, awstETH, polStMATIC
 
 
 class AAVEBot:  # pylint: disable=too-few-public-methods
-    """The main class of the Aave bot"""
+    """The main class of the Aave bot.
+    Workers of every chain with the node endpoints configured run concurrently, every one at its own interval"""
 
     def __init__(self) -> None:
         self.log = logging.getLogger(__name__)
         self.pprint = PrettyPrinter(indent=4)
-        self.chain_id = w3.eth.chain_id
-        self._expose_network_metric()
 
         # List all workers to process
         # NB! less holders first to decrease of the number of requests of error
-        self.workers = (
+        workers = (
             arbwstETH,
             awstETH,
             polStMATIC,
             astETH,
         )
 
+        self.scheduler = Scheduler(self._run_worker, concurrency=MAX_CONCURRENT_WORKERS, cooldown=MAIN_ERROR_COOLDOWN)
+        self.chains: dict[int, list[Worker]] = {}
+        for chain_id in get_chain_ids():
+            reported = get_web3(chain_id).eth.chain_id
+            if reported != chain_id:
+                raise RuntimeError(f"Node endpoints of chain {chain_id} are connected to chain {reported}")
+            self._expose_network_metric(chain_id)
+            self.chains[chain_id] = [w for w in workers if w.pair.chain_id == chain_id]
+
+        for chain_id in {w.pair.chain_id for w in workers if w.pair.chain_id not in self.chains}:
+            self.log.warning("No node endpoint of chain ID %s, workers of the chain are skipped", chain_id)
+
+        for chain_id, chain_workers in self.chains.items():
+            self.log.info("Running on chain ID %s", chain_id)
+            for w in chain_workers:
+                restore_context(w.ctx, w.pair)
+                interval = self._get_interval(w)
+                if REFRESH_TRIGGER == "onchain":
+                    interval = min(interval, TRIGGER_POLL_INTERVAL)
+                self.scheduler.add(w, interval=interval)
+
     def run(self) -> None:
         """Main loop of bot"""
+        self.scheduler.run()
 
-        self.log.info("Running on chain ID %s", self.chain_id)
-        while True:
-            try:
-                for w in self.workers:
-                    if w.pair.chain_id == self.chain_id:
-                        self._run_worker(w)
-            except Exception as ex:  # pylint: disable=broad-except
-                self._on_error(ex)
-            else:
-                self._on_success()
+    @staticmethod
+    def _get_interval(w: Worker) -> int:
+        if w.interval is not None:
+            return w.interval
+        with suppress(ValueError):
+            return CHAIN_PARSE_INTERVALS.get(ChainId(w.pair.chain_id).name.lower(), PARSE_INTERVAL)
+        return PARSE_INTERVAL
 
     def _run_worker(self, w: Worker) -> None:
+        trigger = get_trigger(w.ctx, w.pair, self._get_interval(w))
+        if trigger is not None and trigger.check() is None:
+            return
+
         df = self._fetch(w)
         if df is not None:
-            self._compute_metrics(df, w)
+            # the positions are prepared once for all the analytics of the cycle
+            with APP_ERRORS.labels("analytics").count_exceptions():
+                prepared = prepare_data(df)
+            self._compute_metrics(prepared, w)
+            self._write_snapshot(df, prepared, w)
         PROCESSING_COMPLETED.labels(w.pair.name).set_to_current_time()
+        if trigger is not None:
+            trigger.reset()
 
     @staticmethod
     def _fetch(w: Worker) -> pd.DataFrame | None:
         with FETCH_DURATION.labels(w.pair.name).time():
             with APP_ERRORS.labels("aaveparser").count_exceptions():
-                return fetch(w.ctx, w.pair)
+                if FETCH_BACKEND == "asyncio":
+                    return asyncparser.fetch(w.ctx, w.pair)
+                return aaveparser.fetch(w.ctx, w.pair)
 
     def _compute_metrics(self, df: pd.DataFrame, w: Worker) -> None:
-        for idx, bin_ in enumerate(w.bins):
-            with APP_ERRORS.labels("analytics").count_exceptions():
-                values = get_zones_values(df, bin_)
+        with APP_ERRORS.labels("analytics").count_exceptions():
+            bins_values = get_bins_values(df, w.bins)
+            w.ctx.liquidations = get_liquidation_indexes(df, w.bins)
+
+        for idx, values in enumerate(bins_values):
             for zone, v in values.items():
                 COLLATERALS.labels(w.pair.name, zone, idx + 1).set(v.amount)
                 VALUES.labels(w.pair.name, zone, idx + 1).set(v.value)
@@ -73,17 +136,39 @@ class AAVEBot:  # pylint: disable=too-few-public-methods
             self.log.info("Total amount locked in bin %s: %d", bin_alias, sum(v.amount for v in values.values()))
             self.log.info("Total value locked in bin %s: %d", bin_alias, sum(v.value for v in values.values()))
 
-    def _on_error(self, ex: Exception) -> None:
-        self.log.error("An error occurred", exc_info=ex)
-        self.log.warning("Wait for %d seconds before the next try", MAIN_ERROR_COOLDOWN)
-        time.sleep(MAIN_ERROR_COOLDOWN)
+        for idx, index in enumerate(w.ctx.liquidations):
+            for step in LIQUIDATION_PRICE_STEPS:
+                COLLATERALS_LIQUIDATABLE.labels(w.pair.name, idx + 1, step).set(index.at_risk(index.ratio * step))
 
-    def _on_success(self) -> None:
-        self.log.info("Wait for %d seconds for the next fetch", PARSE_INTERVAL)
-        time.sleep(PARSE_INTERVAL)
+        self._compute_stress_metrics(df, w)
 
-    def _expose_network_metric(self) -> None:
+    @staticmethod
+    def _compute_stress_metrics(df: pd.DataFrame, w: Worker) -> None:
+        shocks = [Shock(s, d) for s in STRESS_SUPPLY_SHOCKS for d in STRESS_DEBT_SHOCKS]
+        if not shocks:
+            return
+
+        with APP_ERRORS.labels("analytics").count_exceptions():
+            bins_values = get_bins_stress_values(df, w.bins, [Shock(s.supply / 100, s.debt / 100) for s in shocks])
+
+        for idx, values in enumerate(bins_values):
+            for shock, amounts in zip(shocks, values):
+                for zone, amount in zip(RISK_LABELS, amounts):
+                    labels = (w.pair.name, zone, idx + 1, f"{shock.supply:g}", f"{shock.debt:g}")
+                    COLLATERALS_STRESSED.labels(*labels).set(amount)
+
+    @staticmethod
+    def _write_snapshot(df: pd.DataFrame, prepared: pd.DataFrame, w: Worker) -> None:
+        if snapshots_store is None:
+            return
+
+        with APP_ERRORS.labels("snapshots").count_exceptions():
+            df = df.merge(get_users_zones(prepared, w.bins), on="user", how="left").astype({"bin": "Int8"})
+            snapshots_store.write(w.pair.name, w.ctx.init_block, df)
+
+    @staticmethod
+    def _expose_network_metric(chain_id: int) -> None:
         network_name = "unknown"
         with suppress(ValueError):
-            network_name = ChainId(self.chain_id).name.lower()
-        NETWORK.labels(network_name, self.chain_id).set(1)
+            network_name = ChainId(chain_id).name.lower()
+        NETWORK.labels(network_name, chain_id).set(1)
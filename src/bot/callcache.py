@@ -0,0 +1,164 @@
+"""Cache of eth_call results pinned to blocks"""
+
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any
+
+from web3 import Web3
+
+from .config import CALL_CACHE_DB_PATH, CALL_CACHE_SIZE_MB
+from .consts import CALL_CACHE_DB_RETAIN_BLOCKS, IMMUTABLE_CALLS
+from .metrics import ETH_CALL_CACHE_REQUESTS, ETH_CALL_CACHE_SIZE
+
+log = logging.getLogger(__name__)
+
+IMMUTABLE_SELECTORS = frozenset(Web3.keccak(text=f).hex()[:10] for f in IMMUTABLE_CALLS)
+
+
+class CallsStore:
+    """SQLite-backed map of the cache keys to the results with the block of every result"""
+
+    def __init__(self, path: str) -> None:
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(calls)")]
+            if columns and "chain_id" not in columns:
+                log.warning("Cached calls of %s have no chain IDs and are dropped", path)
+                self._conn.execute("DROP TABLE calls")
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS calls (
+                    key TEXT PRIMARY KEY,
+                    chain_id INTEGER NOT NULL,
+                    block INTEGER,
+                    result TEXT NOT NULL
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS calls_chain_block ON calls (chain_id, block);
+                """
+            )
+
+    def get(self, key: str) -> str | None:
+        """Get the result stored by the key"""
+
+        with self._lock:
+            row = self._conn.execute("SELECT result FROM calls WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, chain_id: int, key: str, block: int | None, result: str) -> None:
+        """Store the result of the call at the block of the chain, None block for the results which never change"""
+
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO calls (key, chain_id, block, result) VALUES (?, ?, ?, ?)",
+                (key, chain_id, block, result),
+            )
+
+    def prune(self, chain_id: int, block: int) -> None:
+        """Remove results of the calls at the blocks of the chain before the given one"""
+
+        with self._lock, self._conn:
+            deleted = self._conn.execute(
+                "DELETE FROM calls WHERE chain_id = ? AND block < ?", (chain_id, block)
+            ).rowcount
+        log.debug("%d cached calls of chain ID %d before block %d removed", deleted, chain_id, block)
+
+
+class CallCache:
+    """LRU cache of eth_call results keyed by the call and the block number.
+
+    Results of the calls at a certain block never change. Calls of the functions from `IMMUTABLE_CALLS`
+    are cached regardless of the block and never evicted, calls at the other block tags are not cached at all.
+    The memory limit is applied to the total length of the keys and the results, evicted entries
+    are still served by the store if there is one. Keys are prefixed by the chain ID, so a single cache
+    is shared by the chains, and the stored results are pruned by the blocks of every chain separately."""
+
+    def __init__(self, max_bytes: int, store: CallsStore | None = None) -> None:
+        self.max_bytes = max_bytes
+        self.store = store
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, str] = OrderedDict()
+        self._immutable: dict[str, str] = {}
+        self._size = 0
+        self._pruned_at: dict[int, int] = {}  # block of the last prune of every chain
+
+    def get(self, chain_id: int, key: str) -> str | None:
+        """Get the cached result of the call on the chain, None if there is none"""
+
+        key = f"{chain_id}:{key}"
+        with self._lock:
+            result = self._immutable.get(key) or self._entries.get(key)
+            if key in self._entries:
+                self._entries.move_to_end(key)
+
+        if result is None and self.store is not None:
+            result = self.store.get(key)
+            if result is not None:
+                self._remember(key, result)
+
+        ETH_CALL_CACHE_REQUESTS.labels(result="miss" if result is None else "hit").inc()
+        return result
+
+    def put(self, chain_id: int, key: str, block: int | None, result: str) -> None:
+        """Cache the result of the call at the block of the chain"""
+
+        key = f"{chain_id}:{key}"
+        if block is None:
+            self._immutable[key] = result
+        else:
+            self._remember(key, result)
+
+        if self.store is not None:
+            self.store.put(chain_id, key, block, result)
+            pruned_at = self._pruned_at.get(chain_id)
+            if block is not None and (pruned_at is None or block - pruned_at > CALL_CACHE_DB_RETAIN_BLOCKS):
+                self._pruned_at[chain_id] = block
+                self.store.prune(chain_id, block - CALL_CACHE_DB_RETAIN_BLOCKS)
+
+    def _remember(self, key: str, result: str) -> None:
+        size = len(key) + len(result)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(key) + len(previous)
+            self._entries[key] = result
+            self._size += size
+            while self._size > self.max_bytes:
+                evicted_key, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted_key) + len(evicted)
+            ETH_CALL_CACHE_SIZE.set(self._size)
+
+
+def get_call_key(params: Any) -> tuple[str, int | None] | None:
+    """Get cache key and block number of the eth_call parameters, None if the call can't be cached"""
+
+    if len(params) < 2 or not isinstance(params[0], dict):
+        return None
+    transaction, block = params[0], params[1]
+
+    call = ",".join(f"{k}={str(v).lower()}" for k, v in sorted(transaction.items()))
+    if isinstance(block, str) and block.startswith("0x") and len(block) <= 18:
+        number: int | None = int(block, 16)
+    elif isinstance(block, int):
+        number = block
+    elif str(transaction.get("data", ""))[:10] in IMMUTABLE_SELECTORS:
+        return call, None
+    else:
+        return None
+
+    return f"{number}:{call}", number
+
+
+call_cache: CallCache | None = None
+if CALL_CACHE_SIZE_MB > 0 or CALL_CACHE_DB_PATH:
+    call_cache = CallCache(
+        max_bytes=CALL_CACHE_SIZE_MB * 2**20,
+        store=CallsStore(CALL_CACHE_DB_PATH) if CALL_CACHE_DB_PATH else None,
+    )
+    if CALL_CACHE_DB_PATH:
+        log.info("eth_call results are persisted to %s", CALL_CACHE_DB_PATH)
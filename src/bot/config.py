@@ -66,9 +66,107 @@ if "wss://" in NODE_ENDPOINT:
 
 # === Optional ===
 
+# Endpoints of the chains to serve besides the chain of NODE_ENDPOINT by the name of the chain, e.g.
+# NODE_ENDPOINT_POLYGON or NODE_ENDPOINT_ARBITRUM, see ChainId. Comma-separated lists to route requests between
+CHAIN_NODE_ENDPOINTS = {
+    name.removeprefix("NODE_ENDPOINT_").lower(): [e.strip() for e in value.split(",") if e.strip()]
+    for name, value in os.environ.items()
+    if name.startswith("NODE_ENDPOINT_") and value.strip()
+}
+for _endpoints in CHAIN_NODE_ENDPOINTS.values():
+    if any("wss://" in e for e in _endpoints):
+        raise RuntimeError("Only http[s] Web3 provider endpoint supported")
 FALLBACK_NODE_ENDPOINT = getenv("FALLBACK_NODE_ENDPOINT", str, default="")
+# Comma-separated list of more endpoints to route requests between, see router module
+EXTRA_NODE_ENDPOINTS = [e.strip() for e in getenv("EXTRA_NODE_ENDPOINTS", str, default="").split(",") if e.strip()]
 MAIN_ERROR_COOLDOWN = getenv("MAIN_ERROR_COOLDOWN", int, default=15)
 PARSE_INTERVAL = getenv("PARSE_INTERVAL", int, default=2700)
+# Intervals of the workers of a chain by the name of the chain, e.g. PARSE_INTERVAL_ARBITRUM, see ChainId
+CHAIN_PARSE_INTERVALS = {
+    name.removeprefix("PARSE_INTERVAL_").lower(): int(value)
+    for name, value in os.environ.items()
+    if name.startswith("PARSE_INTERVAL_") and value.strip()
+}
+# Shares of the current supply/debt price ratio to expose the collateral liquidatable at
+LIQUIDATION_PRICE_STEPS = [
+    float(s)
+    for s in getenv("LIQUIDATION_PRICE_STEPS", str, default="0.99,0.98,0.97,0.95,0.9,0.85,0.8,0.7").split(",")
+    if s.strip()
+]
+# Directory to write per-user snapshots of every cycle to as Arrow files, empty to disable
+SNAPSHOTS_PATH = getenv("SNAPSHOTS_PATH", str, default="")
+# Snapshots older than the number of days are removed, 0 to keep them regardless of the age
+SNAPSHOTS_RETAIN_DAYS = getenv("SNAPSHOTS_RETAIN_DAYS", int, default=90)
+# Max number of snapshots kept per pair, 0 for unlimited
+SNAPSHOTS_RETAIN_COUNT = getenv("SNAPSHOTS_RETAIN_COUNT", int, default=0)
+# Comma-separated changes of the supply and debt token prices to stress the positions by (in percent), every pair
+# of the supply and debt changes is a scenario. Empty supply changes to disable the stress scenarios
+STRESS_SUPPLY_SHOCKS = [
+    float(s) for s in getenv("STRESS_SUPPLY_SHOCKS", str, default="-1,-2,-5,-10,-20,-30").split(",") if s.strip()
+]
+STRESS_DEBT_SHOCKS = [float(s) for s in getenv("STRESS_DEBT_SHOCKS", str, default="0").split(",") if s.strip()]
+# Max number of workers running their cycles at once
+MAX_CONCURRENT_WORKERS = getenv("MAX_CONCURRENT_WORKERS", int, default=4)
+# What starts a refresh of the positions: interval to refresh every worker's interval, onchain to poll the block,
+# prices and pool events every TRIGGER_POLL_INTERVAL and refresh once they change enough or the interval passes
+REFRESH_TRIGGER = getenv("REFRESH_TRIGGER", str, default="interval")
+if REFRESH_TRIGGER not in ("interval", "onchain"):
+    raise RuntimeError(f"Unsupported {REFRESH_TRIGGER=}, use interval or onchain")
+# Interval to poll the on-chain signals (in seconds)
+TRIGGER_POLL_INTERVAL = getenv("TRIGGER_POLL_INTERVAL", int, default=60)
+# Change of the supply or debt token price since the last refresh to trigger a new one (in percent)
+TRIGGER_PRICE_CHANGE = getenv("TRIGGER_PRICE_CHANGE", float, default=0.5)
+# Number of the pool events touching the supply or debt token since the last refresh to trigger a new one
+TRIGGER_EVENTS_COUNT = getenv("TRIGGER_EVENTS_COUNT", int, default=50)
 EXPORTER_PORT = getenv("EXPORTER_PORT", int, default=8080)
-# 10k blocks per batch is compatible with the most of the providers (for L2s 100k fits better)
-TRANSFER_EVENTS_BATCH = getenv("TRANSFER_EVENTS_BATCH", int, default=10_000)
+# Initial size of the batch to fetch transfer events, 0 to start from the chain's default.
+# The size adapts to the provider responses within the limits below.
+TRANSFER_EVENTS_BATCH = getenv("TRANSFER_EVENTS_BATCH", int, default=0)
+TRANSFER_EVENTS_BATCH_MIN = getenv("TRANSFER_EVENTS_BATCH_MIN", int, default=100)
+TRANSFER_EVENTS_BATCH_MAX = getenv("TRANSFER_EVENTS_BATCH_MAX", int, default=2_000_000)
+# Number of transfer events batches fetched concurrently
+TRANSFER_EVENTS_CONCURRENCY = getenv("TRANSFER_EVENTS_CONCURRENCY", int, default=4)
+if TRANSFER_EVENTS_CONCURRENCY < 1:
+    raise RuntimeError(f"{TRANSFER_EVENTS_CONCURRENCY=} should be at least 1")
+# Max number of requests to the nodes in flight shared by all the workers of all the chains, 0 for unlimited
+RPC_MAX_IN_FLIGHT = getenv("RPC_MAX_IN_FLIGHT", int, default=32)
+# Number of cycles between full refreshes of positions, in between only users touched by
+# the pool events are re-read and the others are revalued by the new prices. 1 to re-read all the users every cycle
+POSITIONS_FULL_REFRESH_CYCLES = getenv("POSITIONS_FULL_REFRESH_CYCLES", int, default=8)
+# Implementation of the fetching pipeline: threads or asyncio
+FETCH_BACKEND = getenv("FETCH_BACKEND", str, default="threads")
+if FETCH_BACKEND not in ("threads", "asyncio"):
+    raise RuntimeError(f"Unsupported {FETCH_BACKEND=}, use threads or asyncio")
+# Path to SQLite file to persist the holders index between restarts, empty to keep it in memory only
+HOLDERS_DB_PATH = getenv("HOLDERS_DB_PATH", str, default="")
+# Number of calls packed into a single Multicall3 aggregate3 call, 0 to disable aggregation
+MULTICALL_BATCH_SIZE = getenv("MULTICALL_BATCH_SIZE", int, default=200)
+# Max number of concurrent requests coalesced into a single JSON-RPC batch, 1 to disable batching
+RPC_BATCH_SIZE = getenv("RPC_BATCH_SIZE", int, default=20)
+# Time to wait for concurrent requests to join a batch (in seconds)
+RPC_BATCH_WINDOW = getenv("RPC_BATCH_WINDOW", float, default=0.01)
+# Percentile of the recent durations of a method to duplicate a late request to another endpoint after, 0 to disable.
+# Takes effect with more than one node endpoint configured
+HEDGE_PERCENTILE = getenv("HEDGE_PERCENTILE", float, default=95)
+# Max share of the requests to be hedged
+HEDGE_BUDGET = getenv("HEDGE_BUDGET", float, default=0.05)
+# Max number of requests per second to every node endpoint, 0 for unlimited.
+# Rate limit errors pause the requests to the endpoint regardless of the setting
+RPC_RATE_LIMIT = getenv("RPC_RATE_LIMIT", float, default=0)
+# Memory limit of eth_call results cache (in MiB), 0 to disable the cache in memory
+CALL_CACHE_SIZE_MB = getenv("CALL_CACHE_SIZE_MB", int, default=64)
+# Path to SQLite file to persist eth_call results cache between restarts, empty to keep it in memory only
+CALL_CACHE_DB_PATH = getenv("CALL_CACHE_DB_PATH", str, default="")
+# Number of keep-alive connections per node endpoint shared by all the threads
+HTTP_POOL_SIZE = getenv("HTTP_POOL_SIZE", int, default=64)
+# 1 to make the pool size a hard limit of connections per endpoint, requests wait for a free connection then
+HTTP_POOL_BLOCK = getenv("HTTP_POOL_BLOCK", int, default=0)
+# Value of Accept-Encoding header to negotiate compressed responses, empty to disable compression
+HTTP_ACCEPT_ENCODING = getenv("HTTP_ACCEPT_ENCODING", str, default="gzip, deflate")
+# Source of users' health factors: onchain to read getUserAccountData of every user, local to compute them
+# from per-reserve balances and prices (v3 pools only) and verify a sample of the users on-chain
+HEALTHF_ENGINE = getenv("HEALTHF_ENGINE", str, default="onchain")
+if HEALTHF_ENGINE not in ("onchain", "local"):
+    raise RuntimeError(f"Unsupported {HEALTHF_ENGINE=}, use onchain or local")
+# Number of users whose locally computed health factors are verified on-chain every cycle
+HEALTHF_VERIFY_SAMPLE = getenv("HEALTHF_VERIFY_SAMPLE", int, default=20)
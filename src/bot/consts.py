@@ -1,9 +1,104 @@
 """Some constants"""
 
+from enum import IntEnum
+
+
+class ChainId(IntEnum):
+    """Chain IDs"""
+
+    HOMESTEAD = 1
+    OPTIMISM = 10
+    POLYGON = 137
+    ARBITRUM = 42161
+
+
 DECIMALS_HEALTHF = 18
 ETH_DECIMALS = 18
 
 MS_3_MIN = 3 * 60 * 1000
 
+# Transfer events batch grows after responses faster and sparser than these
+LOGS_RESPONSE_FAST_SECONDS = 2
+LOGS_RESPONSE_SPARSE_COUNT = 1000
+# Substrings of errors the providers respond with on too wide logs requests
+LOGS_RANGE_ERRORS = (
+    "query returned more than",
+    "response size",
+    "block range",
+    "range too large",
+    "range is too large",
+    "timeout",
+    "timed out",
+)
+
+# Events of AAVE v2 and v3 pools which change users' positions by the number of their indexed address arguments,
+# all the users affected are among them. The address arguments precede the other indexed ones, e.g. referral codes
+POSITION_EVENTS = {
+    "Deposit(address,address,address,uint256,uint16)": 2,
+    "Supply(address,address,address,uint256,uint16)": 2,
+    "Withdraw(address,address,address,uint256)": 3,
+    "Borrow(address,address,address,uint256,uint256,uint256,uint16)": 2,
+    "Borrow(address,address,address,uint256,uint8,uint256,uint16)": 2,
+    "Repay(address,address,address,uint256)": 3,
+    "Repay(address,address,address,uint256,bool)": 3,
+    "LiquidationCall(address,address,address,uint256,uint256,address,bool)": 3,
+    "ReserveUsedAsCollateralEnabled(address,address)": 2,
+    "ReserveUsedAsCollateralDisabled(address,address)": 2,
+    "UserEModeSet(address,uint8)": 1,
+    "Transfer(address,address,uint256)": 2,  # aTokens of extra tokens
+}
+
+# Retries of transient errors with exponential backoff and full jitter (in seconds),
+# retries of rate limited requests are held by the endpoint's throttle instead
 HTTP_REQUESTS_RETRY = 3
-HTTP_REQUESTS_DELAY = 3
+HTTP_REQUESTS_BACKOFF_BASE = 2
+HTTP_REQUESTS_BACKOFF_MAX = 30
+RATE_LIMIT_RETRY = 10
+
+# Rate limiting: number of requests let through at once, pause after a rate limit error without Retry-After
+# doubling with every error in a row (in seconds)
+THROTTLE_BURST = 1
+THROTTLE_BACKOFF_BASE = 1
+THROTTLE_BACKOFF_MAX = 60
+# JSON-RPC error codes and substrings of error messages the providers respond with on exceeding the rate limit
+RATE_LIMIT_ERROR_CODES = (429, -32007, -32090)
+RATE_LIMIT_ERRORS = (
+    "rate limit",
+    "too many requests",
+    "request limit",
+    "compute units",
+)
+
+# Endpoints routing: weight of the latest request in the rolling latency,
+# score penalty per recent error (in seconds) and the time for an error to be half-forgotten (in seconds)
+ROUTER_LATENCY_ALPHA = 0.1
+ROUTER_ERROR_PENALTY = 1
+ROUTER_ERROR_HALF_LIFE = 60
+
+# Hedging: number of the recent durations per method to estimate the percentile from and the least of them
+# to start hedging, max number of hedges which can be spent at once
+HEDGE_WINDOW = 500
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MAX_TOKENS = 10
+
+# Functions whose results never change, so their calls are cached regardless of the block
+IMMUTABLE_CALLS = (
+    "decimals()",
+    "symbol()",
+    "ADDRESSES_PROVIDER()",
+    "getAddressesProvider()",
+    "getPriceOracle()",
+    "BASE_CURRENCY_UNIT()",
+)
+# Number of the latest blocks to keep cached eth_call results for on disk, about a week of mainnet blocks
+CALL_CACHE_DB_RETAIN_BLOCKS = 50_000
+
+# https://github.com/mds1/multicall#multicall3-contract-addresses
+MULTICALL3_ADDRESS = "0xcA11bde05977b3631167028862bE2a173976CA11"
+# Blocks Multicall3 was deployed at, calls at the earlier blocks are performed one by one
+MULTICALL3_DEPLOY_BLOCKS: dict[int, int] = {
+    ChainId.HOMESTEAD: 14_353_601,
+    ChainId.OPTIMISM: 4_286_263,
+    ChainId.POLYGON: 25_770_160,
+    ChainId.ARBITRUM: 7_654_707,
+}
@@ -1,30 +1,182 @@
 """ETH Web3 connection"""
 
 import logging
+from collections.abc import Sequence
+from contextlib import suppress
 from functools import cache
 
-from web3 import HTTPProvider, Web3
+from aiohttp import ClientTimeout
+from requests.exceptions import Timeout
+from web3 import Web3
 from web3.contract import Contract
+from web3.eth import AsyncEth
 from web3.middleware import simple_cache_middleware  # type: ignore
 
-from .config import FALLBACK_NODE_ENDPOINT, NODE_ENDPOINT
-from .middleware import construct_fallback_provider_middleware, metrics_collector, retryable
+from .callcache import call_cache
+from .config import (
+    CHAIN_NODE_ENDPOINTS,
+    EXTRA_NODE_ENDPOINTS,
+    FALLBACK_NODE_ENDPOINT,
+    HEDGE_BUDGET,
+    HEDGE_PERCENTILE,
+    HTTP_ACCEPT_ENCODING,
+    HTTP_POOL_BLOCK,
+    HTTP_POOL_SIZE,
+    NODE_ENDPOINT,
+    RPC_BATCH_SIZE,
+    RPC_BATCH_WINDOW,
+    RPC_MAX_IN_FLIGHT,
+)
+from .consts import LOGS_RANGE_ERRORS, ChainId
+from .middleware import (
+    async_metrics_collector,
+    async_retryable,
+    construct_async_call_cache_middleware,
+    construct_async_concurrency_limiter_middleware,
+    construct_call_cache_middleware,
+    construct_concurrency_limiter_middleware,
+    metrics_collector,
+    retryable,
+)
+from .providers import BatchingHTTPProvider, RoutedAsyncHTTPProvider, build_session
+from .router import EndpointsRouter, HedgingPolicy
+from .throttle import InFlightLimiter
 
 log = logging.getLogger(__name__)
 
 
-w3 = Web3(HTTPProvider(NODE_ENDPOINT, request_kwargs={"timeout": 90}))
-w3.middleware_onion.add(metrics_collector)
-w3.middleware_onion.add(retryable)
-if FALLBACK_NODE_ENDPOINT:
-    w3.middleware_onion.add(construct_fallback_provider_middleware(w3, FALLBACK_NODE_ENDPOINT))
-    log.info("fallback provider is configured")
-w3.middleware_onion.add(simple_cache_middleware)
+# requests in flight to all the chains' endpoints by both fetch backends
+limiter = InFlightLimiter(RPC_MAX_IN_FLIGHT) if RPC_MAX_IN_FLIGHT > 0 else None
+
+# chains of the sync Web3 instances built, see get_chain_id
+_chain_ids: dict[Web3, int] = {}
+
+
+def build_web3(endpoints: Sequence[str]) -> Web3:
+    """Build Web3 instance routing requests between the given endpoints of a chain over connections of its own"""
+
+    if len(endpoints) > 1:
+        log.info("%d node endpoints are configured", len(endpoints))
+
+    web3 = Web3(
+        BatchingHTTPProvider(
+            EndpointsRouter(endpoints),
+            batch_size=RPC_BATCH_SIZE,
+            batch_window=RPC_BATCH_WINDOW,
+            session=build_session(endpoints, HTTP_POOL_SIZE, bool(HTTP_POOL_BLOCK), HTTP_ACCEPT_ENCODING),
+            hedging=HedgingPolicy(HEDGE_PERCENTILE, HEDGE_BUDGET) if HEDGE_PERCENTILE > 0 else None,
+            max_in_flight=RPC_MAX_IN_FLIGHT if RPC_MAX_IN_FLIGHT > 0 else HTTP_POOL_SIZE,
+            request_kwargs={"timeout": 90},
+        )
+    )
+    web3.middleware_onion.add(metrics_collector)
+    if limiter is not None:
+        # wrap the metrics collector to not count the time spent in the queue as the request duration
+        web3.middleware_onion.add(construct_concurrency_limiter_middleware(limiter))
+    web3.middleware_onion.add(retryable)
+    if call_cache is not None:
+        web3.middleware_onion.add(construct_call_cache_middleware(call_cache))
+    web3.middleware_onion.add(simple_cache_middleware)
+    return web3
+
+
+def build_async_web3(endpoints: Sequence[str]) -> Web3:
+    """Build Web3 instance used by asyncio fetch pipeline, see asyncparser module"""
+
+    # web3 v5 types Web3 instances with the sync providers and middlewares only
+    web3 = Web3(
+        RoutedAsyncHTTPProvider(  # type: ignore
+            EndpointsRouter(endpoints),
+            request_kwargs={"timeout": ClientTimeout(total=90)},
+        ),
+        modules={"eth": (AsyncEth,)},
+        middlewares=[],
+    )
+    web3.middleware_onion.add(async_metrics_collector)  # type: ignore
+    if limiter is not None:
+        web3.middleware_onion.add(construct_async_concurrency_limiter_middleware(limiter))
+    web3.middleware_onion.add(async_retryable)  # type: ignore
+    if call_cache is not None:
+        web3.middleware_onion.add(construct_async_call_cache_middleware(call_cache))
+    return web3
+
+
+# endpoints of the chain NODE_ENDPOINT reports
+_default_endpoints = [
+    NODE_ENDPOINT,
+    *([FALLBACK_NODE_ENDPOINT] if FALLBACK_NODE_ENDPOINT else []),
+    *EXTRA_NODE_ENDPOINTS,
+]
+
+# Web3 connected to NODE_ENDPOINT, serves the chain the endpoint reports unless the chain has its own endpoints
+w3 = build_web3(_default_endpoints)
+
+
+@cache
+def get_default_chain_id() -> int:
+    """Get ID of the chain of NODE_ENDPOINT"""
+    return w3.eth.chain_id
+
+
+def get_chain_ids() -> list[int]:
+    """Get IDs of the chains with the node endpoints configured"""
+
+    chain_ids = {get_default_chain_id()}
+    for name in CHAIN_NODE_ENDPOINTS:
+        try:
+            chain_ids.add(ChainId[name.upper()])
+        except KeyError:
+            log.warning("Unknown chain %s, known chains are %s", name, ", ".join(c.name.lower() for c in ChainId))
+    return sorted(chain_ids)
 
 
 @cache
-def get_contract(address: str, abi: str) -> Contract:
-    """Get Contract instance by the given address"""
+def get_web3(chain_id: int) -> Web3:
+    """Get Web3 instance connected to the endpoints of the chain"""
+
+    endpoints = _get_chain_endpoints(chain_id)
+    web3 = build_web3(endpoints) if endpoints else w3
+    _chain_ids[web3] = chain_id
+    return web3
+
+
+@cache
+def get_async_web3(chain_id: int) -> Web3:
+    """Get asyncio Web3 instance connected to the endpoints of the chain"""
+    return build_async_web3(_get_chain_endpoints(chain_id) or _default_endpoints)
+
+
+def get_chain_id(web3: Web3) -> int:
+    """Get ID of the chain the Web3 instance is connected to"""
+    return _chain_ids[web3]
+
+
+@cache
+def get_contract(address: str, abi: str, chain_id: int) -> Contract:
+    """Get Contract instance by the given address on the chain"""
 
     address = Web3.toChecksumAddress(address)
-    return w3.eth.contract(address=address, abi=abi)
+    return get_web3(chain_id).eth.contract(address=address, abi=abi)
+
+
+def is_logs_range_error(ex: Exception) -> bool:
+    """Check if the error is caused by too wide blocks range of logs request"""
+
+    if isinstance(ex, Timeout):
+        return True
+
+    message = str(ex).lower()
+    return any(pattern in message for pattern in LOGS_RANGE_ERRORS)
+
+
+def _get_chain_endpoints(chain_id: int) -> list[str]:
+    """Get the chain's own endpoints, empty list for the chain of NODE_ENDPOINT"""
+
+    with suppress(ValueError):
+        endpoints = CHAIN_NODE_ENDPOINTS.get(ChainId(chain_id).name.lower())
+        if endpoints:
+            return endpoints
+
+    if chain_id != get_default_chain_id():
+        raise LookupError(f"No node endpoints configured for chain {chain_id}")
+    return []
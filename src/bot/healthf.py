@@ -0,0 +1,302 @@
+"""Local computation of users' health factors from per-reserve balances and prices.
+Implemented for AAVE v3 pools only, see the ReserveConfiguration and UserConfiguration libraries of the protocol."""
+
+import logging
+import random
+from collections.abc import Hashable, Sequence
+from dataclasses import dataclass
+from typing import Any
+
+import numpy as np
+import pandas as pd
+from web3 import Web3
+from web3.contract import ContractFunction
+from web3.types import BlockIdentifier
+
+from . import abi
+from .config import HEALTHF_ENGINE, HEALTHF_VERIFY_SAMPLE
+from .consts import DECIMALS_HEALTHF
+from .eth import get_contract
+from .metrics import HEALTHF_DIVERGENCE
+from .multicall import aggregate
+from .structs import Context, LendingPoolV3, Market, PoolPosition, UserInfo, address_table
+
+log = logging.getLogger(__name__)
+
+# health factor reported by the pool for users without debt
+MAX_HEALTHF = (2**256 - 1) / 10**DECIMALS_HEALTHF
+
+# e-mode category id takes 8 bits
+EMODE_CATEGORIES = 256
+
+
+@dataclass
+class Reserves:
+    """Parameters of the pool's reserves, arrays are aligned with `assets`"""
+
+    assets: list[str]
+    ids: list[int]
+    a_tokens: list[str]
+    stable_debt_tokens: list[str]
+    var_debt_tokens: list[str]
+    precisions: np.ndarray
+    ltv: np.ndarray  # in bps
+    liquidation_threshold: np.ndarray  # in bps
+    emode_category: np.ndarray
+    prices: np.ndarray  # in base units
+    # parameters of e-mode categories indexed by category id
+    emode_ltv: np.ndarray
+    emode_liquidation_threshold: np.ndarray
+    emode_prices: np.ndarray  # price of the category's source, NaN if the category has no own price source
+
+
+class HealthFactors:
+    """Per-reserve positions of the users kept as NumPy arrays.
+
+    Only balances counted by the pool are kept: supplies used as collateral and borrowings.
+    Rows of the arrays are aligned with the ids of the users' addresses, see `AddressTable`.
+    Health factors, collaterals and debts are computed for all the users at once by the current prices."""
+
+    def __init__(self, market: Market) -> None:
+        self.market = market
+        self.reserves: Reserves | None = None
+        self.known = np.zeros(0, dtype=bool)
+        self.supplied = np.zeros((0, 0))
+        self.borrowed = np.zeros((0, 0))
+        self.emode = np.zeros(0, dtype=int)
+        # the latest data of the reserves and e-mode categories read, replaces the data of failed calls
+        self._reserves_data: dict[str, Any] = {}
+        self._emodes_data: dict[int, Any] = {}
+
+    def refresh_reserves(self, block: BlockIdentifier) -> bool:
+        """Read parameters and prices of the reserves, returns True if the list of the reserves has changed"""
+
+        pool = self.market.lending_pool.contract.functions
+        assets = pool.getReservesList().call(block_identifier=block)
+        data = _fill_failed([pool.getReserveData(a) for a in assets], assets, self._reserves_data, block)
+        self._reserves_data = dict(zip(assets, data))
+
+        # see ReserveConfiguration library for the bits layout
+        configs = [d[0][0] for d in data]
+        categories = np.array([(c >> 168) & 0xFF for c in configs])
+        emodes = sorted({int(c) for c in categories if c})
+        emodes_data = _fill_failed([pool.getEModeCategoryData(c) for c in emodes], emodes, self._emodes_data, block)
+        self._emodes_data = dict(zip(emodes, emodes_data))
+
+        emode_ltv = np.zeros(EMODE_CATEGORIES)
+        emode_liquidation_threshold = np.zeros(EMODE_CATEGORIES)
+        emode_sources = {}
+        for category, (ltv, threshold, _, source, _) in zip(emodes, emodes_data):
+            emode_ltv[category] = ltv
+            emode_liquidation_threshold[category] = threshold
+            if Web3.toInt(hexstr=source) != 0:
+                emode_sources[category] = source
+
+        oracle = self.market.lending_pool.oracle
+        prices = oracle.functions.getAssetsPrices([*assets, *emode_sources.values()]).call(block_identifier=block)
+        prices = np.array(prices, dtype=float) / self.market.base_precision
+
+        emode_prices = np.full(EMODE_CATEGORIES, np.nan)
+        emode_prices[list(emode_sources)] = prices[len(assets) :]
+
+        reserves = Reserves(
+            assets=assets,
+            ids=[d[7] for d in data],
+            a_tokens=[d[8] for d in data],
+            stable_debt_tokens=[d[9] for d in data],
+            var_debt_tokens=[d[10] for d in data],
+            precisions=np.array([10 ** ((c >> 48) & 0xFF) for c in configs], dtype=float),
+            ltv=np.array([c & 0xFFFF for c in configs], dtype=float),
+            liquidation_threshold=np.array([(c >> 16) & 0xFFFF for c in configs], dtype=float),
+            emode_category=categories,
+            prices=prices[: len(assets)],
+            emode_ltv=emode_ltv,
+            emode_liquidation_threshold=emode_liquidation_threshold,
+            emode_prices=emode_prices,
+        )
+
+        changed = self.reserves is None or self.reserves.assets != reserves.assets
+        if changed:
+            self._reset(len(assets))
+        self.reserves = reserves
+        return changed
+
+    def update_users(self, users: Sequence[str], block: BlockIdentifier, full: bool) -> None:
+        """Read per-reserve balances of the given users, positions of the other users are forgotten on a full refresh"""
+
+        assert self.reserves is not None, "reserves should be read first"
+        reserves = self.reserves
+
+        if full:
+            self._reset(len(reserves.assets))
+
+        pool = self.market.lending_pool.contract.functions
+        checksummed = [address_table.checksum(u) for u in users]
+        results = aggregate(
+            [pool.getUserConfiguration(u) for u in checksummed] + [pool.getUserEMode(u) for u in checksummed],
+            block,
+        )
+        configs, emodes = results[: len(users)], results[len(users) :]
+
+        # read balances of the reserves used by the users only
+        calls, cells = [], []
+        for idx, (user, config) in enumerate(zip(checksummed, configs)):
+            data = config[0] if config is not None else 0
+            if not data:
+                continue
+            for col, reserve_id in enumerate(reserves.ids):
+                if data >> (2 * reserve_id + 1) & 1:
+                    calls.append(self._balance_call(reserves.a_tokens[col], user))
+                    cells.append((True, idx, col))
+                if data >> (2 * reserve_id) & 1:
+                    calls.append(self._balance_call(reserves.stable_debt_tokens[col], user))
+                    cells.append((False, idx, col))
+                    calls.append(self._balance_call(reserves.var_debt_tokens[col], user))
+                    cells.append((False, idx, col))
+
+        supplied = np.zeros((len(users), len(reserves.assets)))
+        borrowed = np.zeros((len(users), len(reserves.assets)))
+        for (is_supply, idx, col), balance in zip(cells, aggregate(calls, block)):
+            target = supplied if is_supply else borrowed
+            target[idx, col] += np.nan if balance is None else balance / reserves.precisions[col]
+
+        # users whose configuration is unknown aren't computed
+        supplied[[c is None for c in configs]] = np.nan
+
+        rows = self._allocate(users)
+        self.known[rows] = True
+        self.supplied[rows] = supplied
+        self.borrowed[rows] = borrowed
+        self.emode[rows] = [e or 0 for e in emodes]
+
+    def compute(self, users: Sequence[str]) -> pd.DataFrame:
+        """Get account data of the given users by the current prices, NaN values for unknown users"""
+
+        assert self.reserves is not None, "reserves should be read first"
+        reserves = self.reserves
+
+        rows = self._allocate(users)
+        known = self.known[rows]
+        rows = rows[known]
+
+        emode = self.emode[rows]
+        in_emode = (emode[:, None] != 0) & (emode[:, None] == reserves.emode_category[None, :])
+
+        emode_prices = reserves.emode_prices[emode][:, None]
+        prices = np.where(in_emode & ~np.isnan(emode_prices), emode_prices, reserves.prices[None, :])
+        threshold = np.where(
+            in_emode, reserves.emode_liquidation_threshold[emode][:, None], reserves.liquidation_threshold
+        )
+        ltv = np.where(in_emode, reserves.emode_ltv[emode][:, None], reserves.ltv)
+
+        # the reserves with zero liquidation threshold aren't collaterals even within e-mode
+        collaterals = self.supplied[rows] * prices * (reserves.liquidation_threshold != 0)
+        collateral = collaterals.sum(axis=1)
+        debt = (self.borrowed[rows] * prices).sum(axis=1)
+        weighted_threshold = (collaterals * threshold).sum(axis=1)
+        weighted_ltv = (collaterals * ltv).sum(axis=1)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            healthfactor = np.where(debt > 0, weighted_threshold / 10_000 / debt, MAX_HEALTHF)
+            liquidation_threshold = np.where(collateral > 0, weighted_threshold / collateral, 0)
+            ltv = np.where(collateral > 0, weighted_ltv / collateral, 0)
+
+        df = pd.DataFrame(
+            np.nan,
+            index=pd.Index(users, name="user"),
+            columns=["collateral", "debt", "liquidation_threshold", "healthfactor", "ltv", "emode"],
+        )
+        df.loc[known, "collateral"] = collateral
+        df.loc[known, "debt"] = debt
+        df.loc[known, "liquidation_threshold"] = np.floor(liquidation_threshold)
+        df.loc[known, "healthfactor"] = np.where(np.isnan(collateral), np.nan, healthfactor)
+        df.loc[known, "ltv"] = np.floor(ltv)
+        df.loc[known, "emode"] = emode
+        return df
+
+    def users_info(self, users: Sequence[str]) -> list[UserInfo]:
+        """Get account data of the given users in the same format as `Market.get_users_info`"""
+
+        df = self.compute(users)
+        df[["liquidation_threshold", "ltv"]] = df[["liquidation_threshold", "ltv"]].fillna(0).astype(int)
+        return [UserInfo(**r) for r in df.to_dict("records")]  # type: ignore
+
+    def apply(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Replace account data within the frame by the locally computed values"""
+
+        computed = self.compute(df["user"].tolist()).reset_index(drop=True)
+        df = df.copy()
+        known = computed["healthfactor"].notna().to_numpy()
+        for column in ("collateral", "debt", "liquidation_threshold", "healthfactor", "ltv"):
+            df.loc[known, column] = computed.loc[known, column].to_numpy()
+        return df
+
+    def verify(self, pair: PoolPosition, df: pd.DataFrame, block: BlockIdentifier) -> None:
+        """Compare health factors of a sample of the borrowers with the on-chain ones"""
+
+        borrowers = df.loc[df["debt"] > 0, "user"].tolist()
+        sample = random.sample(borrowers, min(HEALTHF_VERIFY_SAMPLE, len(borrowers)))
+        if not sample:
+            return
+
+        onchain = np.array([i["healthfactor"] for i in self.market.get_users_info(sample, block)])
+        local = self.compute(sample)["healthfactor"].to_numpy()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            divergence = np.nanmax(np.abs(local - onchain) / onchain, initial=0)
+
+        HEALTHF_DIVERGENCE.labels(pair.name).set(divergence)
+        log.info("Max divergence of %d local health factors from on-chain ones is %.6f", len(sample), divergence)
+
+    def _allocate(self, users: Sequence[str]) -> np.ndarray:
+        """Get rows of the given users, the arrays grow to fit all the interned addresses"""
+
+        rows = address_table.ids(users)
+        size = len(self.known)
+        if size < len(address_table):
+            grow = max(len(address_table), 2 * size) - size
+            width = self.supplied.shape[1]
+            self.known = np.concatenate([self.known, np.zeros(grow, dtype=bool)])
+            self.supplied = np.vstack([self.supplied, np.zeros((grow, width))])
+            self.borrowed = np.vstack([self.borrowed, np.zeros((grow, width))])
+            self.emode = np.concatenate([self.emode, np.zeros(grow, dtype=int)])
+
+        return rows
+
+    def _reset(self, width: int) -> None:
+        self.known = np.zeros(0, dtype=bool)
+        self.supplied = np.zeros((0, width))
+        self.borrowed = np.zeros((0, width))
+        self.emode = np.zeros(0, dtype=int)
+
+    def _balance_call(self, token: str, user: str):
+        contract = get_contract(address=token, abi=abi.ERC20, chain_id=self.market.lending_pool.chain_id)
+        return contract.functions.balanceOf(user)
+
+
+def get_engine(ctx: Context, pair: PoolPosition) -> HealthFactors | None:
+    """Get health factors engine of the worker if the local computation is enabled and supported by the pool"""
+
+    if HEALTHF_ENGINE != "local" or not isinstance(pair.amm.lending_pool, LendingPoolV3):
+        return None
+
+    if ctx.healthf is None:
+        ctx.healthf = HealthFactors(pair.amm)
+    return ctx.healthf
+
+
+def _fill_failed(
+    calls: Sequence[ContractFunction], keys: Sequence[Hashable], previous: dict, block: BlockIdentifier
+) -> list[Any]:
+    """Aggregate the calls, results of the failed ones are replaced with the previous results of the same keys.
+    Calls without previous results are repeated one by one, so a reserve never read fails the refresh"""
+
+    results = aggregate(calls, block)
+    for idx, (fn, key, result) in enumerate(zip(calls, keys, results)):
+        if result is not None:
+            continue
+        if key in previous:
+            log.warning("%s of %s has failed, the previous result is used", fn.fn_name, key)
+            results[idx] = previous[key]
+        else:
+            results[idx] = fn.call(block_identifier=block)
+    return results
@@ -4,7 +4,7 @@ import logging
 import os
 import platform as pf
 
-from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client import Counter, Enum, Gauge, Histogram
 
 log = logging.getLogger(__name__)
 
@@ -17,6 +17,16 @@ COLLATERALS = Gauge(
     "AAVE collaterals distribution",
     ("pair", "zone", "bin"),
 )
+COLLATERALS_LIQUIDATABLE = Gauge(
+    f"{PREFIX}_collaterals_liquidatable",
+    "AAVE collaterals liquidatable once the supply/debt price ratio drops to the share of the current one",
+    ("pair", "bin", "price"),
+)
+COLLATERALS_STRESSED = Gauge(
+    f"{PREFIX}_collaterals_stressed",
+    "AAVE collaterals distribution under the supply and debt token price changes (in percent)",
+    ("pair", "zone", "bin", "supply_shock", "debt_shock"),
+)
 VALUES = Gauge(
     f"{PREFIX}_collaterals_values",
     "AAVE collaterals values distribution",
@@ -32,6 +42,26 @@ FETCH_DURATION = Gauge(
     "Protocol fetching duration",
     ("pair",),
 )
+TRANSFER_EVENTS_BATCH_SIZE = Gauge(
+    f"{PREFIX}_transfer_events_batch_size",
+    "Current size of the blocks range to fetch transfer events",
+    ("pair",),
+)
+WORKER_CYCLE_LAG = Gauge(
+    f"{PREFIX}_worker_cycle_lag_seconds",
+    "Delay of the last cycle start after it was due, caused by the busy workers slots",
+    ("pair",),
+)
+REFRESH_TRIGGERS = Counter(
+    f"{PREFIX}_refresh_triggers",
+    "Checks of the on-chain signals by the reason to refresh the positions, none for the skipped refreshes",
+    ("pair", "reason"),
+)
+POSITIONS_REFRESHED = Gauge(
+    f"{PREFIX}_positions_refreshed",
+    "Number of users whose positions have been re-read from the chain within the last cycle",
+    ("pair",),
+)
 ETH_RPC_REQUESTS = Counter(
     f"{PREFIX}_eth_rpc_requests",
     "Total count of requests to ETH1 RPC",
@@ -42,6 +72,74 @@ ETH_RPC_REQUESTS_DURATION = Histogram(
     "Duration of requests to ETH1 RPC",
     ("provider",),
 )
+ETH_RPC_REQUESTS_IN_FLIGHT = Gauge(
+    f"{PREFIX}_eth_rpc_requests_in_flight",
+    "Number of requests to ETH1 RPC being processed",
+)
+ETH_RPC_LIMITER_WAITING = Gauge(
+    f"{PREFIX}_eth_rpc_limiter_waiting",
+    "Number of requests to ETH1 RPC waiting for the concurrency limiter",
+)
+ETH_RPC_LIMITER_WAIT_DURATION = Histogram(
+    f"{PREFIX}_eth_rpc_limiter_wait_duration",
+    "Time spent by requests to ETH1 RPC waiting for the concurrency limiter",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60),
+)
+HEALTHF_DIVERGENCE = Gauge(
+    f"{PREFIX}_healthf_divergence",
+    "Max relative divergence of local health factors from on-chain ones within the verified sample",
+    ("pair",),
+)
+ETH_RPC_ENDPOINT_SELECTED = Counter(
+    f"{PREFIX}_eth_rpc_endpoint_selected",
+    "Count of requests routed to the node endpoint",
+    ("provider",),
+)
+ETH_RPC_ENDPOINT_LATENCY = Histogram(
+    f"{PREFIX}_eth_rpc_endpoint_latency",
+    "Duration of successful requests to the node endpoint including the wait for the batch",
+    ("provider",),
+)
+ETH_RPC_ENDPOINT_SCORE = Gauge(
+    f"{PREFIX}_eth_rpc_endpoint_score",
+    "Routing score of the node endpoint, the lower the healthier",
+    ("provider",),
+)
+ETH_RPC_HEDGED_REQUESTS = Counter(
+    f"{PREFIX}_eth_rpc_hedged_requests",
+    "Count of requests duplicated to another endpoint due to a late response",
+    ("method",),
+)
+ETH_RPC_HEDGE_WINS = Counter(
+    f"{PREFIX}_eth_rpc_hedge_wins",
+    "Count of hedged requests answered by the duplicate first",
+    ("method",),
+)
+ETH_RPC_THROTTLE_STATE = Enum(
+    f"{PREFIX}_eth_rpc_throttle_state",
+    "State of the node endpoint's throttle: open, limited by the configured rate or paused after a rate limit error",
+    ("provider",),
+    states=["open", "limited", "paused"],
+)
+ETH_CALL_CACHE_REQUESTS = Counter(
+    f"{PREFIX}_eth_call_cache_requests",
+    "Count of eth_call requests looked up in the cache by the result: hit or miss",
+    ("result",),
+)
+ETH_CALL_CACHE_SIZE = Gauge(
+    f"{PREFIX}_eth_call_cache_size_bytes",
+    "Size of eth_call results kept in memory",
+)
+ETH_RPC_CONNECTIONS = Counter(
+    f"{PREFIX}_eth_rpc_connections",
+    "Count of HTTP requests to the node by the state of the connection used: new or reused",
+    ("provider", "state"),
+)
+MULTICALL_FAILED_CALLS = Counter(
+    f"{PREFIX}_multicall_failed_calls",
+    "Count of calls failed within Multicall3 aggregation",
+    ("function",),
+)
 APP_ERRORS = Counter(
     f"{PREFIX}_app_errors",
     "Errors count raised during app lifecycle",
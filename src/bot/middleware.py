@@ -2,17 +2,29 @@
 
 # pylint: disable=unused-argument,invalid-name,unused-import
 
+import asyncio
 import logging
-from typing import Any, Callable, cast
-
-from eth_typing import URI  # type: ignore
-from requests import HTTPError, Response
-from retry.api import retry_call
-from web3 import HTTPProvider, Web3
+import random
+import time
+from typing import Any, Callable, Coroutine
+
+from aiohttp import ClientConnectionError, ClientResponseError
+from requests import ConnectionError as RequestsConnectionError
+from requests import HTTPError, Response, Timeout
+from web3 import Web3
 from web3.types import RPCEndpoint, RPCResponse
 
-from .consts import HTTP_REQUESTS_DELAY, HTTP_REQUESTS_RETRY
-from .metrics import ETH_RPC_REQUESTS, ETH_RPC_REQUESTS_DURATION
+from .callcache import CallCache, get_call_key
+from .consts import HTTP_REQUESTS_BACKOFF_BASE, HTTP_REQUESTS_BACKOFF_MAX, HTTP_REQUESTS_RETRY, RATE_LIMIT_RETRY
+from .metrics import (
+    ETH_RPC_LIMITER_WAIT_DURATION,
+    ETH_RPC_LIMITER_WAITING,
+    ETH_RPC_REQUESTS,
+    ETH_RPC_REQUESTS_DURATION,
+    ETH_RPC_REQUESTS_IN_FLIGHT,
+)
+from .providers import BatchResponseError
+from .throttle import InFlightLimiter, RateLimitError
 
 log = logging.getLogger(__name__)
 
@@ -45,20 +57,28 @@ def metrics_collector(
     """Constructs a middleware which measure requests parameters"""
 
     def middleware(method: RPCEndpoint, params: Any) -> RPCResponse:
-        rpc_domain = _get_provider_domain_from_w3(w3)
-
+        started = time.perf_counter()
         try:
-            with ETH_RPC_REQUESTS_DURATION.labels(provider=rpc_domain).time():
-                response = make_request(method, params)
+            response = make_request(method, params)
+        except RateLimitError as ex:
+            ETH_RPC_REQUESTS.labels(
+                provider=_get_provider_domain_from_w3(w3),
+                method=method,
+                code=ex.code,
+            ).inc()
+            raise
         except HTTPError as ex:
             failed: Response = ex.response
             ETH_RPC_REQUESTS.labels(
-                provider=rpc_domain,
+                provider=_get_provider_domain_from_w3(w3),
                 method=method,
                 code=failed.status_code,
             ).inc()
             raise
         else:
+            # the endpoint is known after the request, see BatchingHTTPProvider
+            rpc_domain = _get_provider_domain_from_w3(w3)
+
             # https://www.jsonrpc.org/specification#error_object
             # https://eth.wiki/json-rpc/json-rpc-error-codes-improvement-proposal
             error = response.get("error")
@@ -72,65 +92,226 @@ def metrics_collector(
             ).inc()
 
             return response
+        finally:
+            ETH_RPC_REQUESTS_DURATION.labels(provider=_get_provider_domain_from_w3(w3)).observe(
+                time.perf_counter() - started
+            )
 
     return middleware
 
 
-def construct_fallback_provider_middleware(w3: Web3, fallback: URI) -> Callable:
-    """Constructs a middleware which mimics fallback provider"""
+async def async_metrics_collector(
+    make_request: Callable[[RPCEndpoint, Any], Coroutine[Any, Any, RPCResponse]], w3: "Web3"
+) -> Callable[[RPCEndpoint, Any], Coroutine[Any, Any, RPCResponse]]:
+    """Asyncio counterpart of `metrics_collector`"""
+
+    async def middleware(method: RPCEndpoint, params: Any) -> RPCResponse:
+        rpc_domain = _get_provider_domain_from_w3(w3)
+
+        try:
+            with ETH_RPC_REQUESTS_DURATION.labels(provider=rpc_domain).time():
+                response = await make_request(method, params)
+        except ClientResponseError as ex:
+            ETH_RPC_REQUESTS.labels(
+                provider=rpc_domain,
+                method=method,
+                code=ex.status,
+            ).inc()
+            raise
+
+        error = response.get("error")
+        code: int = 0
+        if isinstance(error, dict):
+            code = error.get("code") or code
+        ETH_RPC_REQUESTS.labels(
+            provider=rpc_domain,
+            method=method,
+            code=code,
+        ).inc()
+
+        return response
+
+    return middleware
 
-    main_endpoint = getattr(w3.provider, "endpoint_uri")
-    if not main_endpoint:
-        raise ValueError("Web3 provider endpoint is not set")
 
-    def fallback_provider(
+def construct_concurrency_limiter_middleware(limiter: InFlightLimiter) -> Callable:
+    """Constructs a middleware which bounds the number of requests in flight by the given limiter"""
+
+    def concurrency_limiter(
         make_request: Callable[[RPCEndpoint, Any], RPCResponse], _: Web3
     ) -> Callable[[RPCEndpoint, Any], RPCResponse]:
-        """Constructs a middleware which measure requests parameters"""
+        """Constructs a middleware which waits for a free slot before the request"""
 
         def middleware(method: RPCEndpoint, params: Any) -> RPCResponse:
-            switch_to_main()
+            with ETH_RPC_LIMITER_WAITING.track_inprogress(), ETH_RPC_LIMITER_WAIT_DURATION.time():
+                limiter.acquire()
+
             try:
+                with ETH_RPC_REQUESTS_IN_FLIGHT.track_inprogress():
+                    return make_request(method, params)
+            finally:
+                limiter.release()
+
+        return middleware
+
+    return concurrency_limiter
+
+
+def construct_async_concurrency_limiter_middleware(limiter: InFlightLimiter) -> Callable:
+    """Asyncio counterpart of `construct_concurrency_limiter_middleware`"""
+
+    async def concurrency_limiter(
+        make_request: Callable[[RPCEndpoint, Any], Coroutine[Any, Any, RPCResponse]], _: Web3
+    ) -> Callable[[RPCEndpoint, Any], Coroutine[Any, Any, RPCResponse]]:
+        """Constructs a middleware which waits for a free slot before the request"""
+
+        async def middleware(method: RPCEndpoint, params: Any) -> RPCResponse:
+            with ETH_RPC_LIMITER_WAITING.track_inprogress(), ETH_RPC_LIMITER_WAIT_DURATION.time():
+                await limiter.acquire_async()
+
+            try:
+                with ETH_RPC_REQUESTS_IN_FLIGHT.track_inprogress():
+                    return await make_request(method, params)
+            finally:
+                limiter.release()
+
+        return middleware
+
+    return concurrency_limiter
+
+
+def construct_call_cache_middleware(cache: CallCache) -> Callable:
+    """Constructs a middleware which serves eth_call requests pinned to blocks from the cache.
+    The calls are cached per chain, so a single cache is shared by the chains"""
+
+    chain_ids: dict[Web3, int] = {}  # resolved by the first call of every instance
+
+    def call_cache(
+        make_request: Callable[[RPCEndpoint, Any], RPCResponse], w3: Web3
+    ) -> Callable[[RPCEndpoint, Any], RPCResponse]:
+        def middleware(method: RPCEndpoint, params: Any) -> RPCResponse:
+            call = get_call_key(params) if method == "eth_call" else None
+            if call is None:
                 return make_request(method, params)
-            except Exception as e:  # pylint: disable=W0703
-                log.warning("Request to provider has been failed: %s", e)
-                switch_to_fallback()
-                return make_request(method, params)
+
+            if w3 not in chain_ids:
+                chain_ids[w3] = w3.eth.chain_id
+            key, block = call
+            result = cache.get(chain_ids[w3], key)
+            if result is not None:
+                return {"jsonrpc": "2.0", "id": 0, "result": result}
+
+            response = make_request(method, params)
+            if "result" in response and "error" not in response:
+                cache.put(chain_ids[w3], key, block, response["result"])
+            return response
 
         return middleware
 
-    def switch_to_main() -> None:
-        w3.provider = cast(HTTPProvider, w3.provider)
-        if w3.provider.endpoint_uri != main_endpoint:
-            w3.provider.endpoint_uri = main_endpoint
-            log.debug("Switched to main provider")
+    return call_cache
+
+
+def construct_async_call_cache_middleware(cache: CallCache) -> Callable:
+    """Asyncio counterpart of `construct_call_cache_middleware`"""
+
+    chain_ids: dict[Web3, int] = {}
 
-    def switch_to_fallback() -> None:
-        w3.provider = cast(HTTPProvider, w3.provider)
-        if w3.provider.endpoint_uri != fallback:
-            w3.provider.endpoint_uri = fallback
-            log.debug("Switched to fallback provider")
+    async def call_cache(
+        make_request: Callable[[RPCEndpoint, Any], Coroutine[Any, Any, RPCResponse]], w3: Web3
+    ) -> Callable[[RPCEndpoint, Any], Coroutine[Any, Any, RPCResponse]]:
+        async def middleware(method: RPCEndpoint, params: Any) -> RPCResponse:
+            call = get_call_key(params) if method == "eth_call" else None
+            if call is None:
+                return await make_request(method, params)
 
-    return fallback_provider
+            if w3 not in chain_ids:
+                chain_ids[w3] = await w3.eth.chain_id  # type: ignore
+            key, block = call
+            result = cache.get(chain_ids[w3], key)
+            if result is not None:
+                return {"jsonrpc": "2.0", "id": 0, "result": result}
+
+            response = await make_request(method, params)
+            if "result" in response and "error" not in response:
+                cache.put(chain_ids[w3], key, block, response["result"])
+            return response
+
+        return middleware
+
+    return call_cache
 
 
 def retryable(
     make_request: Callable[[RPCEndpoint, Any], RPCResponse], _: Web3
 ) -> Callable[[RPCEndpoint, Any], RPCResponse]:
-    """Constructs a middleware which retries requests to the endpoint"""
+    """Constructs a middleware which retries requests failed due to transient errors or the rate limit.
+    Transient errors are retried after jittered exponential backoff, rate limited requests are retried right away
+    to be held by the endpoint's throttle. Other errors are raised immediately."""
 
     def middleware(method: RPCEndpoint, params: Any) -> RPCResponse:
+        attempts = rate_limited = 0
+        while True:
+            try:
+                return make_request(method, params)
+            except RateLimitError:
+                rate_limited += 1
+                if rate_limited >= RATE_LIMIT_RETRY:
+                    raise
+            except Exception as ex:  # pylint: disable=broad-except
+                attempts += 1
+                if attempts >= HTTP_REQUESTS_RETRY or not _is_transient(ex):
+                    raise
+                delay = _get_backoff(attempts)
+                log.warning("%s, retrying in %.1f seconds...", ex, delay)
+                time.sleep(delay)
+
+    return middleware
 
-        return retry_call(
-            make_request,
-            (method, params),
-            tries=HTTP_REQUESTS_RETRY,
-            delay=HTTP_REQUESTS_DELAY,
-        )
+
+async def async_retryable(
+    make_request: Callable[[RPCEndpoint, Any], Coroutine[Any, Any, RPCResponse]], _: Web3
+) -> Callable[[RPCEndpoint, Any], Coroutine[Any, Any, RPCResponse]]:
+    """Asyncio counterpart of `retryable`"""
+
+    async def middleware(method: RPCEndpoint, params: Any) -> RPCResponse:
+        attempts = rate_limited = 0
+        while True:
+            try:
+                return await make_request(method, params)
+            except RateLimitError:
+                rate_limited += 1
+                if rate_limited >= RATE_LIMIT_RETRY:
+                    raise
+            except Exception as ex:  # pylint: disable=broad-except
+                attempts += 1
+                if attempts >= HTTP_REQUESTS_RETRY or not _is_transient(ex):
+                    raise
+                delay = _get_backoff(attempts)
+                log.warning("%s, retrying in %.1f seconds...", ex, delay)
+                await asyncio.sleep(delay)
 
     return middleware
 
 
+def _is_transient(ex: Exception) -> bool:
+    """Check whether the request may succeed once repeated"""
+
+    if isinstance(ex, (RequestsConnectionError, Timeout, ClientConnectionError, asyncio.TimeoutError)):
+        return True
+    if isinstance(ex, BatchResponseError):
+        return True
+    if isinstance(ex, HTTPError) and ex.response is not None:
+        return ex.response.status_code >= 500 or ex.response.status_code == 408
+    if isinstance(ex, ClientResponseError):
+        return ex.status >= 500 or ex.status == 408
+    return False
+
+
+def _get_backoff(attempt: int) -> float:
+    """Get delay before the next attempt, full jitter spreads the retries of the threads failed at once"""
+    return random.uniform(0, min(HTTP_REQUESTS_BACKOFF_MAX, HTTP_REQUESTS_BACKOFF_BASE * 2 ** (attempt - 1)))
+
+
 def _get_provider_domain_from_w3(w3: Web3) -> str:
     """Get provider domain from Web3 object"""
 
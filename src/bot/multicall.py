@@ -0,0 +1,154 @@
+"""Aggregation of contract reads via Multicall3"""
+
+import asyncio
+import logging
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from web3._utils.abi import get_abi_output_types  # type: ignore
+from web3.contract import ContractFunction
+from web3.exceptions import ContractLogicError
+from web3.types import BlockIdentifier
+
+from . import abi
+from .config import HTTP_POOL_SIZE, MULTICALL_BATCH_SIZE
+from .consts import MULTICALL3_ADDRESS, MULTICALL3_DEPLOY_BLOCKS
+from .eth import get_async_web3, get_chain_id, get_contract
+from .metrics import MULTICALL_FAILED_CALLS
+
+log = logging.getLogger(__name__)
+
+# calls are performed by threads of their own, the callers may be pool threads themselves waiting for the results
+_pool = ThreadPoolExecutor(max_workers=max(HTTP_POOL_SIZE, 1), thread_name_prefix="multicall")
+
+
+def aggregate(calls: Sequence[ContractFunction], block: BlockIdentifier) -> list[Any]:
+    """Perform the given calls at the block, failed calls result in None"""
+
+    if not calls:
+        return []
+
+    if MULTICALL_BATCH_SIZE <= 0 or not _is_deployed(calls, block):
+        tasks = [_pool.submit(_call, fn, block) for fn in calls]
+        return [task.result() for task in tasks]
+
+    tasks = [
+        _pool.submit(_aggregate3, calls[i : i + MULTICALL_BATCH_SIZE], block)
+        for i in range(0, len(calls), MULTICALL_BATCH_SIZE)
+    ]
+    return [r for task in tasks for r in task.result()]
+
+
+def _is_deployed(calls: Sequence[ContractFunction], block: BlockIdentifier) -> bool:
+    """Check whether Multicall3 exists at the block of the calls' chain, e.g. for backfills of the early blocks"""
+
+    if not isinstance(block, int):
+        return True
+    return block >= MULTICALL3_DEPLOY_BLOCKS.get(get_chain_id(calls[0].web3), 0)
+
+
+def _call(fn: ContractFunction, block: BlockIdentifier) -> Any:
+    """Perform a single call, mimics allowFailure of aggregate3"""
+
+    try:
+        return fn.call(block_identifier=block)
+    except ValueError as ex:
+        if not _is_reverted(ex):
+            raise
+        MULTICALL_FAILED_CALLS.labels(fn.fn_name).inc()
+        return None
+
+
+def _is_reverted(ex: ValueError) -> bool:
+    """Check whether the call has been reverted, nethermind reports reverts as plain execution errors"""
+    return isinstance(ex, ContractLogicError) or "execution error" in str(ex)
+
+
+def _aggregate3(calls: Sequence[ContractFunction], block: BlockIdentifier) -> list[Any]:
+    """Pack the given calls into a single aggregate3 call"""
+
+    response = _aggregate3_function(calls).call(block_identifier=block)
+    return _decode_results(calls, response)
+
+
+async def aggregate_async(calls: Sequence[ContractFunction], block: BlockIdentifier) -> list[Any]:
+    """Asyncio counterpart of `aggregate`"""
+
+    if not calls:
+        return []
+
+    if MULTICALL_BATCH_SIZE <= 0 or not _is_deployed(calls, block):
+        return list(await asyncio.gather(*(_call_async(fn, block) for fn in calls)))
+
+    batches = [calls[i : i + MULTICALL_BATCH_SIZE] for i in range(0, len(calls), MULTICALL_BATCH_SIZE)]
+    chunks = await asyncio.gather(*(_aggregate3_async(batch, block) for batch in batches))
+    return [r for chunk in chunks for r in chunk]
+
+
+async def _call_async(fn: ContractFunction, block: BlockIdentifier) -> Any:
+    """Asyncio counterpart of `_call`"""
+
+    aw3 = get_async_web3(get_chain_id(fn.web3))
+    try:
+        data = await aw3.eth.call({"to": fn.address, "data": _encode(fn)}, block)  # type: ignore
+    except ValueError as ex:
+        if not _is_reverted(ex):
+            raise
+        MULTICALL_FAILED_CALLS.labels(fn.fn_name).inc()
+        return None
+
+    return _decode_output(fn, data)
+
+
+async def _aggregate3_async(calls: Sequence[ContractFunction], block: BlockIdentifier) -> list[Any]:
+    """Asyncio counterpart of `_aggregate3`"""
+
+    fn = _aggregate3_function(calls)
+    aw3 = get_async_web3(get_chain_id(fn.web3))
+    data = await aw3.eth.call({"to": fn.address, "data": _encode(fn)}, block)  # type: ignore
+    (response,) = fn.web3.codec.decode_abi(get_abi_output_types(fn.abi), data)
+    return _decode_results(calls, response)
+
+
+def _aggregate3_function(calls: Sequence[ContractFunction]) -> ContractFunction:
+    """Build aggregate3 call for the given calls on their chain, failures of the calls are allowed"""
+
+    multicall = get_contract(address=MULTICALL3_ADDRESS, abi=abi.Multicall3, chain_id=get_chain_id(calls[0].web3))
+    payload = [(fn.address, True, _encode(fn)) for fn in calls]
+    return multicall.functions.aggregate3(payload)
+
+
+def _decode_results(calls: Sequence[ContractFunction], response: Sequence[tuple[bool, bytes]]) -> list[Any]:
+    """Decode aggregate3 response, failed calls result in None"""
+
+    results: list[Any] = []
+    for fn, (success, data) in zip(calls, response):
+        if not success:
+            MULTICALL_FAILED_CALLS.labels(fn.fn_name).inc()
+            results.append(None)
+            continue
+        results.append(_decode_output(fn, data))
+
+    return results
+
+
+def _encode(fn: ContractFunction) -> str:
+    """Get calldata of the function call"""
+    return fn._encode_transaction_data()  # pylint: disable=protected-access
+
+
+def _decode_output(fn: ContractFunction, data: bytes) -> Any:
+    """Decode function output the same way ContractFunction.call does"""
+
+    output_types = get_abi_output_types(fn.abi)
+    try:
+        decoded = fn.web3.codec.decode_abi(output_types, data)
+    except Exception:  # pylint: disable=broad-except
+        # e.g. a call to an address without code returns empty data
+        MULTICALL_FAILED_CALLS.labels(fn.fn_name).inc()
+        return None
+
+    if len(decoded) == 1:
+        return decoded[0]
+    return decoded
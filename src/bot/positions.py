@@ -0,0 +1,188 @@
+"""Cache of users' positions refreshed by the pool events"""
+
+import asyncio
+import logging
+from collections import deque
+from collections.abc import Sequence
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+from web3 import Web3
+from web3.types import LogReceipt
+
+from .config import POSITIONS_FULL_REFRESH_CYCLES, TRANSFER_EVENTS_BATCH_MIN
+from .consts import POSITION_EVENTS
+from .eth import get_web3, is_logs_range_error
+from .metrics import POSITIONS_REFRESHED
+from .structs import AddressSet, Context, PoolPosition
+
+log = logging.getLogger(__name__)
+
+POSITION_EVENTS_TOPICS = [Web3.keccak(text=e).hex() for e in POSITION_EVENTS]
+# number of the indexed address arguments by the event topic
+POSITION_EVENTS_ADDRESSES = {Web3.keccak(text=e): count for e, count in POSITION_EVENTS.items()}
+
+# columns of the frame returned by fetch
+COLUMNS = [
+    "user",
+    "amount",
+    "supply_price",
+    "debt_price",
+    "collateral",
+    "debt",
+    "liquidation_threshold",
+    "healthfactor",
+    "ltv",
+    "emode",
+    "borrowed",
+    "extra_amount",
+]
+
+
+class Prices(NamedTuple):
+    """Prices of the pair's tokens in base units"""
+
+    supply: float
+    debt: float
+    extra: tuple[float, ...]
+
+
+def get_prices(ctx: Context, pair: PoolPosition) -> Prices:
+    """Get prices of the pair's tokens at the current block"""
+
+    return Prices(
+        supply=pair.get_supply_token_price(ctx.curr_block),
+        debt=pair.get_debt_token_price(ctx.curr_block),
+        extra=tuple(pair.get_token_price(t.address, ctx.curr_block) for t in pair.extra_tokens),
+    )
+
+
+async def get_prices_async(ctx: Context, pair: PoolPosition) -> Prices:
+    """Asyncio counterpart of `get_prices`"""
+
+    supply, debt, *extra = await asyncio.gather(
+        pair.get_token_price_async(pair.supply_token.address, ctx.curr_block),
+        pair.get_token_price_async(pair.debt_token.address, ctx.curr_block),
+        *(pair.get_token_price_async(t.address, ctx.curr_block) for t in pair.extra_tokens),
+    )
+    return Prices(supply=supply, debt=debt, extra=tuple(extra))
+
+
+def select_users_to_refresh(ctx: Context, pair: PoolPosition, touched: AddressSet) -> tuple[list[str], bool]:
+    """Get users whose positions should be re-read from the chain and whether it's a full refresh.
+    Users are sorted to pack the same calls into the same multicalls, so the calls cache is hit on re-runs"""
+
+    if ctx.positions is None or ctx.cycles_since_full_refresh + 1 >= POSITIONS_FULL_REFRESH_CYCLES:
+        return sorted(ctx.holders), True
+
+    dirty = find_users_touched_by_events(ctx, pair) | touched
+    return sorted(h for h in ctx.holders if h in dirty or h not in ctx.positions.index), False
+
+
+def find_users_touched_by_events(ctx: Context, pair: PoolPosition) -> AddressSet:
+    """Get addresses found among the indexed arguments of the position-changing events since the last cycle"""
+
+    touched = AddressSet()
+    for entry in get_position_events(pair, ctx.init_block, ctx.curr_block, ctx.logs_batch):
+        topics = entry["topics"]
+        for topic in topics[1 : 1 + POSITION_EVENTS_ADDRESSES.get(topics[0], 0)]:
+            touched.add(topic[-20:])
+
+    return touched
+
+
+def get_position_events(pair: PoolPosition, from_block: int, to_block: int, batch: int) -> list[LogReceipt]:
+    """Get the position-changing events of the pool within the blocks range fetched by batches of the given size.
+    Batches rejected as too wide are split in halves, the same way as the Transfer events ones"""
+
+    events: list[LogReceipt] = []
+    addresses = [pair.amm.lending_pool.address, *(t.a_token.address for t in pair.extra_tokens)]
+    pending: deque[tuple[int, int]] = deque()
+
+    block = from_block
+    while block <= to_block or pending:
+        if not pending:
+            batch_end = min(block + max(batch, 1) - 1, to_block)
+            pending.append((block, batch_end))
+            block = batch_end + 1
+
+        start, end = pending.popleft()
+        try:
+            events += get_web3(pair.chain_id).eth.get_logs(
+                {
+                    "address": [Web3.toChecksumAddress(a) for a in addresses],
+                    "topics": [POSITION_EVENTS_TOPICS],  # type: ignore
+                    "fromBlock": start,
+                    "toBlock": end,
+                }
+            )
+        except Exception as ex:  # pylint: disable=broad-except
+            if not is_logs_range_error(ex) or end - start < TRANSFER_EVENTS_BATCH_MIN:
+                raise
+            batch = max(min(batch, (end - start + 1) // 2), TRANSFER_EVENTS_BATCH_MIN)
+            log.warning("Pool events request has been rejected, shrink the blocks range to %d: %s", batch, ex)
+            # split the failed range and put it in front of the queue to keep the order
+            middle = (start + end) // 2
+            pending.extendleft([(middle + 1, end), (start, middle)])
+
+    return events
+
+
+def update_positions(
+    ctx: Context,
+    pair: PoolPosition,
+    fresh: pd.DataFrame,
+    extra_balances: Sequence[Sequence[float]],
+    prices: Prices,
+    full: bool,
+) -> pd.DataFrame:
+    """Merge fresh positions with the cached ones revalued by the current prices"""
+
+    POSITIONS_REFRESHED.labels(pair.name).set(len(fresh))
+
+    fresh = fresh.set_index("user")
+    for idx, balances in enumerate(extra_balances):
+        fresh[_extra_column(idx)] = balances
+
+    if full or ctx.positions is None:
+        ctx.cycles_since_full_refresh = 0
+        positions = fresh
+    else:
+        ctx.cycles_since_full_refresh += 1
+        cached = ctx.positions
+        cached = cached[cached.index.isin(ctx.holders) & ~cached.index.isin(fresh.index)]
+        cached = revalue_positions(cached, prices)
+        positions = pd.concat([cached, fresh]) if not cached.empty else fresh
+        log.info("%d positions refreshed, %d revalued", len(fresh), len(cached))
+
+    ctx.positions = positions
+    return positions.reset_index().reindex(columns=COLUMNS)
+
+
+def revalue_positions(df: pd.DataFrame, prices: Prices) -> pd.DataFrame:
+    """Recalculate base currency values of the positions by the new prices of the supply, debt and extra tokens.
+    Other assets of the users are considered unchanged, as well as the average liquidation threshold."""
+
+    df = df.copy()
+
+    extra_amount = pd.Series(0.0, index=df.index)
+    for idx, price in enumerate(prices.extra):
+        extra_amount += df[_extra_column(idx)].fillna(0) * price
+
+    df["collateral"] += df["amount"] * (prices.supply - df["supply_price"]) + (extra_amount - df["extra_amount"])
+    df["debt"] += df["borrowed"] * (prices.debt - df["debt_price"])
+    df["healthfactor"] = np.where(
+        df["debt"] > 0,
+        df["collateral"] * df["liquidation_threshold"] / 10_000 / df["debt"].where(df["debt"] > 0),
+        df["healthfactor"],
+    )
+    df["supply_price"] = prices.supply
+    df["debt_price"] = prices.debt
+    df["extra_amount"] = extra_amount
+
+    return df
+
+
+def _extra_column(idx: int) -> str:
+    return f"extra_balance_{idx}"
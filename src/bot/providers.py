@@ -0,0 +1,436 @@
+"""Web3 providers"""
+
+import json
+import logging
+import threading
+import time
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any
+from urllib.parse import urlparse
+
+from aiohttp import ClientResponseError, ClientSession, TraceConfig
+from eth_typing import URI  # type: ignore
+from eth_utils import to_bytes
+from requests import PreparedRequest, Response, Session
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from web3 import AsyncHTTPProvider, HTTPProvider
+from web3.types import RPCEndpoint, RPCResponse
+
+from .consts import HEDGE_MAX_TOKENS
+from .metrics import ETH_RPC_CONNECTIONS, ETH_RPC_HEDGE_WINS, ETH_RPC_HEDGED_REQUESTS
+from .router import Endpoint, EndpointsRouter, HedgingPolicy
+from .throttle import RateLimitError, get_throttle, is_rate_limited, parse_retry_after
+
+log = logging.getLogger(__name__)
+
+# methods which must not be sent twice
+NON_IDEMPOTENT_METHODS = ("eth_sendTransaction", "eth_sendRawTransaction")
+
+
+class BatchResponseError(ValueError):
+    """Batch has been responded not as expected"""
+
+
+# whether the current thread has opened a new connection during the request
+_connection_state = threading.local()
+
+
+class _TrackedHTTPConnection(HTTPConnection):
+    def connect(self) -> None:
+        super().connect()
+        _connection_state.opened = True
+
+
+class _TrackedHTTPSConnection(HTTPSConnection):
+    def connect(self) -> None:
+        super().connect()
+        _connection_state.opened = True
+
+
+class _TrackedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TrackedHTTPConnection
+
+
+class _TrackedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TrackedHTTPSConnection
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """HTTP adapter which counts new and reused connections to the hosts"""
+
+    def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TrackedHTTPConnectionPool,
+            "https": _TrackedHTTPSConnectionPool,
+        }
+
+    def send(self, request: PreparedRequest, *args: Any, **kwargs: Any) -> Response:  # type: ignore
+        _connection_state.opened = False
+        response = super().send(request, *args, **kwargs)
+        state = "new" if _connection_state.opened else "reused"
+        ETH_RPC_CONNECTIONS.labels(provider=urlparse(request.url).hostname, state=state).inc()
+        return response
+
+
+def build_connections_trace(endpoint: str) -> TraceConfig:
+    """Build aiohttp trace config which counts new and reused connections to the endpoint"""
+
+    provider = urlparse(endpoint).hostname
+
+    async def on_connection_create_end(*_: Any) -> None:
+        ETH_RPC_CONNECTIONS.labels(provider=provider, state="new").inc()
+
+    async def on_connection_reuseconn(*_: Any) -> None:
+        ETH_RPC_CONNECTIONS.labels(provider=provider, state="reused").inc()
+
+    trace = TraceConfig()
+    trace.on_connection_create_end.append(on_connection_create_end)
+    trace.on_connection_reuseconn.append(on_connection_reuseconn)
+    return trace
+
+
+def build_session(endpoints: Sequence[str], pool_size: int, pool_block: bool, accept_encoding: str) -> Session:
+    """Build HTTP session sharing a pool of keep-alive connections to the endpoints between the threads.
+    Pool size is the number of connections kept alive per host, connections beyond it are closed after the requests
+    unless the pool blocks the requests until a connection is released. A pool is kept for every host of the endpoints,
+    so the pools are not evicted by the requests to the other hosts."""
+
+    hosts = {urlparse(e).netloc for e in endpoints}
+    session = Session()
+    adapter = PooledHTTPAdapter(pool_connections=max(len(hosts), 1), pool_maxsize=pool_size, pool_block=pool_block)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["Accept-Encoding"] = accept_encoding or "identity"
+    return session
+
+
+@dataclass
+class _PendingRequest:
+    """Single JSON-RPC request waiting for the response within a batch"""
+
+    payload: dict[str, Any]
+    done: threading.Event = field(default_factory=threading.Event)
+    response: RPCResponse | None = None
+    error: Exception | None = None
+
+
+@dataclass
+class _Batch:
+    """Requests to be sent to the endpoint in a single HTTP request"""
+
+    requests: list[_PendingRequest] = field(default_factory=list)
+    sealed: threading.Event = field(default_factory=threading.Event)
+
+
+class BatchingHTTPProvider(HTTPProvider):
+    """HTTP provider which coalesces concurrent requests into JSON-RPC batches.
+
+    The first request of a batch waits for `batch_window` seconds for the others to join and sends the batch unless
+    it has been filled up to `batch_size` requests and sent already by the thread which filled it.
+    Every caller gets its own response, so middlewares keep working per logical request.
+
+    The requests are sent via the given session shared by all the threads and endpoints, unlike the default
+    web3 behaviour to keep a session per thread and endpoint.
+
+    Every request is sent to the endpoint picked by the router, a failed request is sent to the next healthiest
+    endpoint until all of them are tried. `endpoint_uri` is the endpoint of the last request of the current thread.
+
+    Every endpoint has its own throttle, see throttle module. Rate limit errors of the endpoint are raised
+    as `RateLimitError` after pausing the throttle.
+
+    Given the hedging policy and more than one endpoint, a slow request is duplicated to another endpoint
+    and the first successful response wins. Requests which can be hedged are sent from a pool of threads then,
+    sized for `max_in_flight` requests along with the duplicates and lost primaries of a burst of hedges,
+    the others are sent by the caller thread."""
+
+    def __init__(
+        self,
+        router: EndpointsRouter,
+        batch_size: int,
+        batch_window: float,
+        session: Session,
+        hedging: HedgingPolicy | None = None,
+        max_in_flight: int = 32,
+        **kwargs: Any,
+    ) -> None:
+        self._local = threading.local()
+        super().__init__(router.endpoints[0].uri, **kwargs)
+        self.router = router
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.session = session
+        self.hedging = hedging if len(router.endpoints) > 1 else None
+        self._executor = (
+            ThreadPoolExecutor(max(max_in_flight, 1) + HEDGE_MAX_TOKENS, thread_name_prefix="hedging")
+            if self.hedging
+            else None
+        )
+        self._lock = threading.Lock()
+        self._batches: dict[str, _Batch] = {}
+
+    @property  # type: ignore
+    def endpoint_uri(self) -> URI:
+        return getattr(self._local, "endpoint_uri", self._default_endpoint_uri)
+
+    @endpoint_uri.setter
+    def endpoint_uri(self, value: URI) -> None:
+        self._default_endpoint_uri = value
+
+    def make_request(self, method: RPCEndpoint, params: Any) -> RPCResponse:
+        if self.hedging is not None and method not in NON_IDEMPOTENT_METHODS:
+            return self._make_hedged_request(method, params)
+        return self._make_routed_request(method, params)
+
+    def _make_routed_request(
+        self,
+        method: RPCEndpoint,
+        params: Any,
+        tried: Sequence[Endpoint] = (),
+        error: Exception | None = None,
+    ) -> RPCResponse:
+        """Send the request to the healthiest endpoint not tried yet, try the next one on failure"""
+
+        tried = list(tried)
+        while True:
+            if error is not None:
+                if len(tried) >= len(self.router.endpoints):
+                    raise error
+                log.warning("Request to %s has been failed: %s", tried[-1].provider, error)
+
+            endpoint = self.router.pick(exclude=tried)
+            self._local.endpoint_uri = URI(endpoint.uri)
+            try:
+                return self._attempt(endpoint, method, params)
+            except Exception as ex:  # pylint: disable=broad-except
+                tried.append(endpoint)
+                error = ex
+
+    def _make_hedged_request(self, method: RPCEndpoint, params: Any) -> RPCResponse:
+        """Send the request and its duplicate to another endpoint if the response is late, the first success wins"""
+
+        assert self.hedging is not None and self._executor is not None
+
+        primary = self.router.pick()
+        delay = self.hedging.delay(method)
+        if delay is None:
+            # too few samples to hedge by, don't take a thread of the pool
+            self._local.endpoint_uri = URI(primary.uri)
+            try:
+                return self._attempt(primary, method, params)
+            except Exception as ex:  # pylint: disable=broad-except
+                return self._make_routed_request(method, params, tried=[primary], error=ex)
+
+        futures = {self._executor.submit(self._attempt, primary, method, params): primary}
+        done, _ = wait(futures, timeout=delay)
+        if not done and self.hedging.acquire():
+            secondary = self.router.pick(exclude=[primary])
+            futures[self._executor.submit(self._attempt, secondary, method, params)] = secondary
+            ETH_RPC_HEDGED_REQUESTS.labels(method=method).inc()
+
+        error: Exception | None = None
+        for future in as_completed(futures):
+            endpoint = futures[future]
+            self._local.endpoint_uri = URI(endpoint.uri)
+            try:
+                response = future.result()
+            except Exception as ex:  # pylint: disable=broad-except
+                error = ex
+                continue
+            if endpoint is not primary:
+                ETH_RPC_HEDGE_WINS.labels(method=method).inc()
+            return response
+
+        return self._make_routed_request(method, params, tried=list(futures.values()), error=error)
+
+    def _attempt(self, endpoint: Endpoint, method: RPCEndpoint, params: Any) -> RPCResponse:
+        """Send the request to the endpoint and let the router, throttle and hedging policy know the outcome"""
+
+        throttle = get_throttle(endpoint.uri)
+        throttle.acquire()
+
+        started = time.perf_counter()
+        try:
+            response = self._make_request(endpoint.uri, method, params)
+            error = response.get("error")
+            if isinstance(error, dict) and is_rate_limited(error):
+                raise RateLimitError(error.get("message", ""), code=error.get("code", 0))
+        except Exception as ex:
+            if isinstance(ex, RateLimitError):
+                throttle.pause(ex.retry_after)
+            self.router.observe(endpoint, time.perf_counter() - started, ok=False)
+            raise
+
+        duration = time.perf_counter() - started
+        throttle.reset()
+        self.router.observe(endpoint, duration, ok=True)
+        if self.hedging is not None:
+            self.hedging.observe(method, duration)
+        return response
+
+    def _make_request(self, endpoint: str, method: RPCEndpoint, params: Any) -> RPCResponse:
+        if self.batch_size <= 1:
+            log.debug("Making request HTTP. URI: %s, Method: %s", endpoint, method)
+            raw_response = self._post(endpoint, self.encode_rpc_request(method, params))
+            return self.decode_rpc_response(raw_response)
+
+        request = _PendingRequest(
+            payload={
+                "jsonrpc": "2.0",
+                "method": method,
+                "params": params or [],
+                "id": next(self.request_counter),
+            }
+        )
+
+        with self._lock:
+            batch = self._batches.get(endpoint)
+            is_leader = batch is None
+            if batch is None:
+                batch = self._batches[endpoint] = _Batch()
+            batch.requests.append(request)
+            is_full = len(batch.requests) >= self.batch_size
+            if is_full:
+                del self._batches[endpoint]
+                batch.sealed.set()
+
+        if is_full:
+            self._send(endpoint, batch)
+        elif is_leader:
+            batch.sealed.wait(self.batch_window)
+            with self._lock:
+                is_unsent = self._batches.get(endpoint) is batch
+                if is_unsent:
+                    del self._batches[endpoint]
+            if is_unsent:
+                self._send(endpoint, batch)
+
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.response  # type: ignore
+
+    def _send(self, endpoint: str, batch: _Batch) -> None:
+        """Send the batch and dispatch responses to the waiting callers"""
+
+        pending = {r.payload["id"]: r for r in batch.requests}
+        try:
+            log.debug("Sending batch of %d requests to %s", len(pending), endpoint)
+            data = to_bytes(text=json.dumps([r.payload for r in batch.requests]))
+            raw_response = self._post(endpoint, data)
+            responses = self.decode_rpc_response(raw_response)
+            if not isinstance(responses, list):
+                # a provider may respond with a single error object for the whole batch
+                error = responses.get("error") if isinstance(responses, dict) else None
+                if isinstance(error, dict) and is_rate_limited(error):
+                    raise RateLimitError(error.get("message", ""), code=error.get("code", 0))
+                raise BatchResponseError(f"Unexpected response to the batch request: {responses}")
+
+            for response in responses:
+                request = pending.pop(response.get("id"), None)
+                if request is not None:
+                    request.response = response
+
+            for request in pending.values():
+                request.error = BatchResponseError(
+                    f"No response to the request {request.payload['id']} within the batch"
+                )
+        except Exception as ex:  # pylint: disable=broad-except
+            for request in batch.requests:
+                if request.response is None:
+                    request.error = ex
+        finally:
+            for request in batch.requests:
+                request.done.set()
+
+    def _post(self, endpoint: str, data: bytes) -> bytes:
+        response = self.session.post(endpoint, data=data, **self.get_request_kwargs())  # type: ignore
+        if response.status_code == 429:
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            raise RateLimitError(f"429 Too Many Requests for url: {endpoint}", code=429, retry_after=retry_after)
+        response.raise_for_status()
+        return response.content
+
+
+class RoutedAsyncHTTPProvider(AsyncHTTPProvider):
+    """Asyncio counterpart of BatchingHTTPProvider without batching and hedging.
+
+    Every request is sent to the endpoint picked by the router, a failed request is sent to the next healthiest
+    endpoint until all of them are tried. `endpoint_uri` is the endpoint of the last request of the current task.
+
+    Every endpoint has its own throttle and session, the sessions are expected to be set up by `cache_async_session`
+    within the event loop the requests are made in."""
+
+    def __init__(self, router: EndpointsRouter, **kwargs: Any) -> None:
+        self._endpoint_uri: ContextVar[URI | None] = ContextVar("endpoint_uri", default=None)
+        super().__init__(router.endpoints[0].uri, **kwargs)
+        self.router = router
+        self.sessions: dict[str, ClientSession] = {}
+
+    @property  # type: ignore
+    def endpoint_uri(self) -> URI:
+        return self._endpoint_uri.get() or self._default_endpoint_uri
+
+    @endpoint_uri.setter
+    def endpoint_uri(self, value: URI) -> None:
+        self._default_endpoint_uri = value
+
+    async def cache_async_session(self, session: ClientSession, endpoint: str | None = None) -> None:
+        """Use the session for the requests to the given endpoint, the primary one by default"""
+        self.sessions[endpoint or self._default_endpoint_uri] = session
+
+    async def make_request(self, method: RPCEndpoint, params: Any) -> RPCResponse:
+        tried: list[Endpoint] = []
+        while True:
+            endpoint = self.router.pick(exclude=tried)
+            self._endpoint_uri.set(URI(endpoint.uri))
+            try:
+                return await self._attempt(endpoint, method, params)
+            except Exception as ex:  # pylint: disable=broad-except
+                tried.append(endpoint)
+                if len(tried) >= len(self.router.endpoints):
+                    raise
+                log.warning("Request to %s has been failed: %s", endpoint.provider, ex)
+
+    async def _attempt(self, endpoint: Endpoint, method: RPCEndpoint, params: Any) -> RPCResponse:
+        """Send the request to the endpoint and let the router and throttle know the outcome"""
+
+        throttle = get_throttle(endpoint.uri)
+        await throttle.acquire_async()
+
+        started = time.perf_counter()
+        try:
+            log.debug("Making request HTTP. URI: %s, Method: %s", endpoint.uri, method)
+            raw_response = await self._post(endpoint.uri, self.encode_rpc_request(method, params))
+            response = self.decode_rpc_response(raw_response)
+            error = response.get("error")
+            if isinstance(error, dict) and is_rate_limited(error):
+                raise RateLimitError(error.get("message", ""), code=error.get("code", 0))
+        except Exception as ex:
+            if isinstance(ex, RateLimitError):
+                throttle.pause(ex.retry_after)
+            self.router.observe(endpoint, time.perf_counter() - started, ok=False)
+            raise
+
+        throttle.reset()
+        self.router.observe(endpoint, time.perf_counter() - started, ok=True)
+        return response
+
+    async def _post(self, endpoint: str, data: bytes) -> bytes:
+        session = self.sessions.get(endpoint)
+        if session is None:
+            session = self.sessions[endpoint] = ClientSession(raise_for_status=True)
+
+        try:
+            async with session.post(endpoint, data=data, **self.get_request_kwargs()) as response:
+                return await response.read()
+        except ClientResponseError as ex:
+            if ex.status != 429:
+                raise
+            retry_after = parse_retry_after(ex.headers.get("Retry-After") if ex.headers else None)
+            raise RateLimitError(str(ex), code=429, retry_after=retry_after) from ex
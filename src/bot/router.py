@@ -0,0 +1,135 @@
+"""Routing of requests between the node endpoints"""
+
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from collections.abc import Sequence
+from dataclasses import dataclass, field
+from urllib.parse import urlparse
+
+import numpy as np
+
+from .consts import (
+    HEDGE_MAX_TOKENS,
+    HEDGE_MIN_SAMPLES,
+    HEDGE_WINDOW,
+    ROUTER_ERROR_HALF_LIFE,
+    ROUTER_ERROR_PENALTY,
+    ROUTER_LATENCY_ALPHA,
+)
+from .metrics import ETH_RPC_ENDPOINT_LATENCY, ETH_RPC_ENDPOINT_SCORE, ETH_RPC_ENDPOINT_SELECTED
+
+log = logging.getLogger(__name__)
+
+
+@dataclass(eq=False)
+class Endpoint:
+    """Node endpoint with its rolling statistics"""
+
+    uri: str
+    latency: float | None = None  # exponential moving average of successful requests durations, None if untried
+    errors: float = 0.0  # count of recent errors decaying with time
+    errors_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def provider(self) -> str:
+        """Label of the endpoint in metrics"""
+        return urlparse(self.uri).hostname or "unknown"
+
+    def recent_errors(self, now: float) -> float:
+        """Get count of errors decayed to the given moment"""
+        return self.errors * 0.5 ** ((now - self.errors_at) / ROUTER_ERROR_HALF_LIFE)
+
+    def score(self, now: float, untried_latency: float) -> float:
+        """Get score of the endpoint in seconds, the lower the healthier"""
+        latency = untried_latency if self.latency is None else self.latency
+        return latency + ROUTER_ERROR_PENALTY * self.recent_errors(now)
+
+
+class EndpointsRouter:
+    """Picks the healthiest endpoint for every request.
+
+    Endpoints are scored by rolling latency and recent errors, ties are resolved by the order of the endpoints.
+    Errors decay with time, so a failed endpoint gets traffic back once it stays unused long enough.
+    Untried endpoints are scored pessimistically as the slowest tried one with an error, so the fallback endpoints
+    get traffic once the preceding ones fail rather than once they are measured."""
+
+    def __init__(self, uris: Sequence[str]) -> None:
+        if not uris:
+            raise ValueError("At least one endpoint is required")
+        self.endpoints = [Endpoint(uri) for uri in uris]
+        self._lock = threading.Lock()
+
+    def pick(self, exclude: Sequence[Endpoint] = ()) -> Endpoint:
+        """Get the healthiest endpoint except the given ones"""
+
+        now = time.monotonic()
+        candidates = [e for e in self.endpoints if e not in exclude] or self.endpoints
+        untried_latency = self._untried_latency()
+        endpoint = min(candidates, key=lambda e: e.score(now, untried_latency))
+        ETH_RPC_ENDPOINT_SELECTED.labels(provider=endpoint.provider).inc()
+        return endpoint
+
+    def observe(self, endpoint: Endpoint, duration: float, ok: bool) -> None:
+        """Update statistics of the endpoint by the request outcome"""
+
+        now = time.monotonic()
+        with self._lock:
+            if ok:
+                ETH_RPC_ENDPOINT_LATENCY.labels(provider=endpoint.provider).observe(duration)
+                if endpoint.latency is not None:
+                    endpoint.latency += ROUTER_LATENCY_ALPHA * (duration - endpoint.latency)
+                else:
+                    endpoint.latency = duration
+            else:
+                endpoint.errors = endpoint.recent_errors(now) + 1
+                endpoint.errors_at = now
+
+            ETH_RPC_ENDPOINT_SCORE.labels(provider=endpoint.provider).set(endpoint.score(now, self._untried_latency()))
+
+    def _untried_latency(self) -> float:
+        """Get latency assumed for the endpoints without successful requests yet"""
+
+        tried = [e.latency for e in self.endpoints if e.latency is not None]
+        return max(tried, default=0.0) + ROUTER_ERROR_PENALTY
+
+
+class HedgingPolicy:
+    """Decides when a slow request deserves a duplicate sent to another endpoint.
+
+    A request is hedged once it takes longer than the given percentile of the recent durations of the same method.
+    Every request earns `budget` of a token and every hedge spends a whole one, so the share of the hedged requests
+    stays within the budget ratio."""
+
+    def __init__(self, percentile: float, budget: float) -> None:
+        self.percentile = percentile
+        self.budget = budget
+        self._lock = threading.Lock()
+        self._durations: defaultdict[str, deque[float]] = defaultdict(lambda: deque(maxlen=HEDGE_WINDOW))
+        self._tokens = 0.0
+
+    def delay(self, method: str) -> float | None:
+        """Get time to wait for the response before hedging, None if the request shouldn't be hedged"""
+
+        with self._lock:
+            self._tokens = min(self._tokens + self.budget, HEDGE_MAX_TOKENS)
+            durations = self._durations[method]
+            if len(durations) < HEDGE_MIN_SAMPLES:
+                return None
+            return float(np.percentile(durations, self.percentile))
+
+    def acquire(self) -> bool:
+        """Take a token for the hedge if there are any left"""
+
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def observe(self, method: str, duration: float) -> None:
+        """Remember duration of the successful request"""
+
+        with self._lock:
+            self._durations[method].append(duration)
@@ -0,0 +1,79 @@
+"""Scheduling of the workers cycles"""
+
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Callable
+
+from .metrics import WORKER_CYCLE_LAG
+from .worker import Worker
+
+log = logging.getLogger(__name__)
+
+
+@dataclass(eq=False)
+class Job:
+    """Schedule of the worker"""
+
+    worker: Worker
+    interval: float
+    due: float = 0.0  # monotonic time of the next cycle
+    failures: int = 0  # failed cycles in a row
+
+
+class Scheduler:
+    """Runs cycles of every worker at its own interval.
+
+    Up to `concurrency` workers run at once, the due ones start in order of their due time. The next cycle
+    of the worker is due the interval after the previous one finished. A failed cycle is retried after the cooldown
+    doubling with every failure in a row up to the worker's interval, the other workers aren't affected."""
+
+    def __init__(self, run: Callable[[Worker], None], concurrency: int, cooldown: float) -> None:
+        self.run_worker = run
+        self.concurrency = max(concurrency, 1)
+        self.cooldown = cooldown
+        self.jobs: list[Job] = []
+
+    def add(self, worker: Worker, interval: float) -> None:
+        """Schedule the worker with its first cycle due right away"""
+        self.jobs.append(Job(worker, interval, due=time.monotonic()))
+
+    def run(self) -> None:
+        """Run the workers forever"""
+
+        if not self.jobs:
+            log.warning("No workers to run")
+            return
+
+        running: dict[Future, Job] = {}
+        with ThreadPoolExecutor(self.concurrency, thread_name_prefix="worker") as executor:
+            while True:
+                now = time.monotonic()
+                idle = sorted((j for j in self.jobs if j not in running.values()), key=lambda j: j.due)
+                while idle and idle[0].due <= now and len(running) < self.concurrency:
+                    job = idle.pop(0)
+                    running[executor.submit(self._cycle, job, now - job.due)] = job
+
+                # wake up by the next due cycle only if there is a free slot to start it
+                timeout = max(idle[0].due - now, 0) if idle and len(running) < self.concurrency else None
+                done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    del running[future]
+
+    def _cycle(self, job: Job, lag: float) -> None:
+        key = job.worker.pair.key
+        try:
+            WORKER_CYCLE_LAG.labels(job.worker.pair.name).set(lag)
+            self.run_worker(job.worker)
+        except Exception as ex:  # pylint: disable=broad-except
+            job.failures += 1
+            delay = min(self.cooldown * 2 ** (job.failures - 1), job.interval)
+            log.error("An error occurred in %s", key, exc_info=ex)
+            log.warning("Wait for %d seconds before the next try of %s", delay, key)
+        else:
+            job.failures = 0
+            delay = job.interval
+            log.info("Wait for %d seconds for the next fetch of %s", delay, key)
+
+        job.due = time.monotonic() + delay
@@ -0,0 +1,120 @@
+"""Per-user snapshots of the cycles stored as Arrow files.
+
+Snapshots are laid out as `<root>/pair=<pair>/block=<block>.arrow`. Arrow IPC files are written uncompressed,
+so the readers memory-map them and get the columns without copying the data into memory."""
+
+import logging
+import os
+import re
+import time
+from collections.abc import Iterable
+from pathlib import Path
+from typing import NamedTuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc  # pylint: disable=unused-import
+
+from .config import SNAPSHOTS_PATH, SNAPSHOTS_RETAIN_COUNT, SNAPSHOTS_RETAIN_DAYS
+
+log = logging.getLogger(__name__)
+
+SNAPSHOT_RE = re.compile(r"block=(\d+)\.arrow")
+
+
+class Snapshot(NamedTuple):
+    """Snapshot file of the pair at the block"""
+
+    pair: str
+    block: int
+    path: Path
+
+
+class SnapshotsStore:
+    """Writer of the snapshots with the retention by age and number of the snapshots per pair"""
+
+    def __init__(self, root: str, retain_days: int, retain_count: int) -> None:
+        self.root = Path(root)
+        self.retain_days = retain_days
+        self.retain_count = retain_count
+
+    def write(self, pair: str, block: int, df: pd.DataFrame) -> Path:
+        """Write the frame as the snapshot of the pair at the block and apply the retention to the pair"""
+
+        directory = self.root / f"pair={pair}"
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"block={block}.arrow"
+
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        tmp = path.with_suffix(".tmp")
+        with pa.OSFile(str(tmp), "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(tmp, path)  # readers never see partially written files
+
+        log.info("Snapshot of %d users of %s at the block %d is written to %s", len(df), pair, block, path)
+        self.prune(pair)
+        return path
+
+    def prune(self, pair: str) -> None:
+        """Remove snapshots of the pair beyond the retention limits"""
+
+        snapshots = list_snapshots(self.root, pair)
+        expired: set[Path] = set()
+        if self.retain_count > 0:
+            expired.update(s.path for s in snapshots[: -self.retain_count])
+        if self.retain_days > 0:
+            deadline = time.time() - self.retain_days * 86400
+            expired.update(s.path for s in snapshots if s.path.stat().st_mtime < deadline)
+
+        for path in expired:
+            path.unlink(missing_ok=True)
+        if expired:
+            log.info("%d snapshots of %s are removed by the retention", len(expired), pair)
+
+
+def list_snapshots(root: str | Path, pair: str | None = None) -> list[Snapshot]:
+    """Get snapshots of the pair or of all the pairs ordered by the pair and block"""
+
+    snapshots = []
+    for directory in Path(root).glob(f"pair={pair}" if pair else "pair=*"):
+        for path in directory.iterdir():
+            if match := SNAPSHOT_RE.fullmatch(path.name):
+                snapshots.append(Snapshot(directory.name.removeprefix("pair="), int(match[1]), path))
+    return sorted(snapshots, key=lambda s: (s.pair, s.block))
+
+
+def read_snapshot(path: str | Path) -> pa.Table:
+    """Memory-map the snapshot file, the columns are read from the disk on access"""
+
+    with pa.memory_map(str(path), "r") as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+def read_snapshots(
+    root: str | Path,
+    pair: str,
+    from_block: int = 0,
+    to_block: int | None = None,
+    columns: Iterable[str] | None = None,
+) -> pa.Table:
+    """Memory-map the snapshots of the pair within the blocks range into a single table with `block` column.
+    Select the columns and filter the rows before `to_pandas` call, which copies the data into memory"""
+
+    tables = []
+    for snapshot in list_snapshots(root, pair):
+        if snapshot.block < from_block or (to_block is not None and snapshot.block > to_block):
+            continue
+        table = read_snapshot(snapshot.path)
+        if columns is not None:
+            table = table.select(list(columns))
+        tables.append(table.append_column("block", pa.array([snapshot.block] * table.num_rows, pa.int64())))
+
+    if not tables:
+        return pa.table({})
+    return pa.concat_tables(tables, promote_options="default")
+
+
+snapshots_store: SnapshotsStore | None = None
+if SNAPSHOTS_PATH:
+    snapshots_store = SnapshotsStore(SNAPSHOTS_PATH, SNAPSHOTS_RETAIN_DAYS, SNAPSHOTS_RETAIN_COUNT)
+    log.info("Snapshots are written to %s", SNAPSHOTS_PATH)
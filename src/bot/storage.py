@@ -0,0 +1,70 @@
+"""Persistent storage of the aToken holders index"""
+
+import logging
+import sqlite3
+import threading
+from collections.abc import Iterable
+
+from .config import HOLDERS_DB_PATH
+
+log = logging.getLogger(__name__)
+
+
+class HoldersStore:
+    """SQLite-backed set of holders with the blocks cursor per key"""
+
+    def __init__(self, path: str) -> None:
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS cursors (
+                    key TEXT PRIMARY KEY,
+                    block INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS holders (
+                    key TEXT NOT NULL,
+                    address TEXT NOT NULL,
+                    PRIMARY KEY (key, address)
+                ) WITHOUT ROWID;
+                """
+            )
+
+    def load(self, key: str) -> tuple[int, list[str]]:
+        """Get the last scanned block and the known holders for the given key"""
+
+        with self._lock:
+            row = self._conn.execute("SELECT block FROM cursors WHERE key = ?", (key,)).fetchone()
+            holders = [r[0] for r in self._conn.execute("SELECT address FROM holders WHERE key = ?", (key,))]
+
+        return (row[0] if row else 0), holders
+
+    def save(self, key: str, block: int, holders: Iterable[str]) -> None:
+        """Add holders and move the cursor forward in a single transaction"""
+
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO holders (key, address) VALUES (?, ?)",
+                ((key, h) for h in holders),
+            )
+            self._conn.execute(
+                "INSERT INTO cursors (key, block) VALUES (?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET block = MAX(block, excluded.block)",
+                (key, block),
+            )
+
+    def discard(self, key: str, holders: Iterable[str]) -> None:
+        """Remove holders from the index"""
+
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "DELETE FROM holders WHERE key = ? AND address = ?",
+                ((key, h) for h in holders),
+            )
+
+
+holders_store: HoldersStore | None = None
+if HOLDERS_DB_PATH:
+    holders_store = HoldersStore(HOLDERS_DB_PATH)
+    log.info("holders index is persisted to %s", HOLDERS_DB_PATH)
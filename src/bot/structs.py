@@ -1,52 +1,111 @@
 """Data structs"""
 
+import asyncio
 import math
+import threading
 from abc import ABC, abstractmethod
+from collections.abc import Iterable, Sequence
 from contextlib import suppress
 from dataclasses import dataclass, field
-from enum import IntEnum
 from functools import cached_property
-from typing import ClassVar, NamedTuple, TypedDict
-
-from eth_typing.encoding import HexStr
+from typing import TYPE_CHECKING, ClassVar, NamedTuple, TypedDict
+
+import numpy as np
+import pandas as pd
+from eth_typing.evm import ChecksumAddress
+from eth_utils import to_checksum_address
+from web3 import Web3
+from web3.contract import Contract, ContractFunction
 from web3.exceptions import ContractLogicError
 from web3.types import BlockIdentifier
 
 from . import abi
-from .consts import DECIMALS_HEALTHF, ETH_DECIMALS
-from .eth import get_contract, w3
+from .consts import DECIMALS_HEALTHF, ETH_DECIMALS, ChainId
+from .eth import get_contract
+from .multicall import aggregate, aggregate_async
+
+if TYPE_CHECKING:
+    from .analytics import LiquidationIndex
+    from .healthf import HealthFactors
+    from .trigger import RefreshTrigger
+
+
+class AddressTable:
+    """Interning table which maps 20-byte addresses to dense integer ids.
+    Checksummed form of an address is computed once and the same string object is shared by all the users."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._ids: dict[bytes, int] = {}
+        self._addresses: list[ChecksumAddress] = []
+
+    def __len__(self) -> int:
+        return len(self._addresses)
 
+    def intern(self, address: str | bytes) -> int:
+        """Get id of the address, an unseen address gets the next id"""
 
-class ChainId(IntEnum):
-    """Chain IDs"""
+        key = bytes.fromhex(address[-40:]) if isinstance(address, str) else bytes(address[-20:])
+        id_ = self._ids.get(key)
+        if id_ is None:
+            with self._lock:
+                id_ = self._ids.get(key)
+                if id_ is None:
+                    id_ = len(self._addresses)
+                    self._addresses.append(to_checksum_address(key))
+                    self._ids[key] = id_
+        return id_
 
-    HOMESTEAD = 1
-    OPTIMISM = 10
-    POLYGON = 137
-    ARBITRUM = 42161
+    def ids(self, addresses: Iterable[str | bytes]) -> np.ndarray:
+        """Get ids of the addresses"""
+        return np.fromiter((self.intern(a) for a in addresses), dtype=np.int64)
+
+    def address(self, id_: int) -> ChecksumAddress:
+        """Get checksummed address by its id"""
+        return self._addresses[id_]
+
+    def checksum(self, address: str | bytes) -> ChecksumAddress:
+        """Get interned checksummed form of the address"""
+        return self._addresses[self.intern(address)]
+
+
+address_table = AddressTable()
+NULL_ADDRESS_ID = address_table.intern(b"\0" * 20)
 
 
 class AddressSet(set):
-    """Set for ETH addresses"""
+    """Set for ETH addresses, the addresses are stored in interned checksummed form"""
 
-    def add(self, __element: HexStr) -> None:
-        if w3.toInt(hexstr=__element) == 0:
+    def add(self, __element: str | bytes) -> None:
+        id_ = address_table.intern(__element)
+        if id_ == NULL_ADDRESS_ID:
             return  # skip NULL address
-        super().add(__element)
+        super().add(address_table.address(id_))
 
 
 @dataclass
 class IsContract:
     """Simple code generator for contracts declarations.
-    `contract` field is initialized via object construction and attributes are proxied to it."""
+    `contract` field is initialized on the first access on the chain the declaration is bound to
+    and attributes are proxied to it."""
 
     address: str
     abi: ClassVar[str]
+    chain_id: ChainId = field(default=ChainId.HOMESTEAD, kw_only=True)
+
+    @cached_property
+    def contract(self) -> Contract:
+        """Contract instance on the chain"""
+        return get_contract(address=self.address, abi=self.abi, chain_id=self.chain_id)
 
-    def __post_init__(self):
-        self.contract = get_contract(address=self.address, abi=self.abi)
+    def bind(self, chain_id: ChainId) -> None:
+        """Bind the declaration to the chain"""
+        self.chain_id = chain_id
+        self.__dict__.pop("contract", None)
 
     def __getattr__(self, item):
+        if item == "contract":
+            raise AttributeError(item)  # failed to initialize, don't recurse
         return getattr(self.contract, item)
 
 
@@ -73,9 +132,22 @@ class ERC20Like(IsContract):
 
     def balance(self, user: str, block: BlockIdentifier) -> float:
         """Get user balance"""
-        user = w3.toChecksumAddress(user)
+        user = address_table.checksum(user)
         return self.contract.functions.balanceOf(user).call(block_identifier=block) / self.precision
 
+    def balances(self, users: Sequence[str], block: BlockIdentifier) -> list[float]:
+        """Get balances of the given users, NaN for failed calls"""
+        results = aggregate(self._balance_calls(users), block)
+        return [_scale(r, self.precision) for r in results]
+
+    async def balances_async(self, users: Sequence[str], block: BlockIdentifier) -> list[float]:
+        """Asyncio counterpart of `balances`"""
+        results = await aggregate_async(self._balance_calls(users), block)
+        return [_scale(r, self.precision) for r in results]
+
+    def _balance_calls(self, users: Sequence[str]) -> list[ContractFunction]:
+        return [self.contract.functions.balanceOf(address_table.checksum(u)) for u in users]
+
 
 @dataclass
 class SupplyToken(ERC20Like):
@@ -112,9 +184,17 @@ class Oracle(ABC, IsContract):
 
     def asset_price(self, asset: str, block: BlockIdentifier) -> float:
         """Get asset price in base units"""
-        asset = w3.toChecksumAddress(asset)
+        asset = Web3.toChecksumAddress(asset)
         return self.contract.functions.getAssetPrice(asset).call(block_identifier=block) / self.precision
 
+    async def asset_price_async(self, asset: str, block: BlockIdentifier) -> float:
+        """Asyncio counterpart of `asset_price`"""
+        address = address_table.checksum(asset)
+        (price,) = await aggregate_async([self.contract.functions.getAssetPrice(address)], block)
+        if price is None:
+            raise ValueError(f"Unable to get price of {address} at block {block!r}")
+        return price / self.precision
+
 
 class OracleV2(Oracle):
     """AAVE Oracle V2"""
@@ -169,13 +249,13 @@ class LendingPoolV2(LendingPool):
     def addresses_provider(self) -> IsContract:
         """Lending Pool Addresses Provider"""
         address = self.contract.functions.getAddressesProvider().call()
-        return PoolAddressesProvider(address=address)
+        return PoolAddressesProvider(address=address, chain_id=self.chain_id)
 
     @cached_property
     def oracle(self) -> Oracle:
         """LendingPool Price Oracle"""
         address = self.addresses_provider.functions.getPriceOracle().call()
-        return OracleV2(address=address)
+        return OracleV2(address=address, chain_id=self.chain_id)
 
 
 @dataclass
@@ -186,13 +266,13 @@ class LendingPoolV3(LendingPool):
     def addresses_provider(self) -> IsContract:
         """Lending Pool Addresses Provider"""
         address = self.contract.functions.ADDRESSES_PROVIDER().call()
-        return PoolAddressesProvider(address=address)
+        return PoolAddressesProvider(address=address, chain_id=self.chain_id)
 
     @cached_property
     def oracle(self) -> Oracle:
         """LendingPool Price Oracle"""
         address = self.addresses_provider.functions.getPriceOracle().call()
-        return OracleV3(address=address)
+        return OracleV3(address=address, chain_id=self.chain_id)
 
 
 class LPUserAccountDataResponse(NamedTuple):
@@ -232,12 +312,16 @@ class Market:
 
     def get_asset_price(self, asset: str, block: BlockIdentifier) -> float:
         """Get asset price in base units"""
-        asset = w3.toChecksumAddress(asset)
+        asset = Web3.toChecksumAddress(asset)
         return self.lending_pool.oracle.asset_price(asset, block)
 
+    async def get_asset_price_async(self, asset: str, block: BlockIdentifier) -> float:
+        """Asyncio counterpart of `get_asset_price`"""
+        return await self.lending_pool.oracle.asset_price_async(asset, block)
+
     def get_user_info(self, user: str, block: BlockIdentifier) -> UserInfo:
         """Get user account data from AAVE Lending Pool"""
-        user = w3.toChecksumAddress(user)
+        user = address_table.checksum(user)
         r = self.lending_pool.contract.functions.getUserAccountData(user).call(block_identifier=block)
         r = LPUserAccountDataResponse(*r)
 
@@ -262,6 +346,50 @@ class Market:
 
         return None
 
+    def get_users_info(self, users: Sequence[str], block: BlockIdentifier) -> list[UserInfo]:
+        """Get account data of the given users, NaN values for failed calls"""
+        results = aggregate(self._user_info_calls(users), block)
+        return self._to_users_info(users, results)
+
+    async def get_users_info_async(self, users: Sequence[str], block: BlockIdentifier) -> list[UserInfo]:
+        """Asyncio counterpart of `get_users_info`"""
+        results = await aggregate_async(self._user_info_calls(users), block)
+        return self._to_users_info(users, results)
+
+    def _user_info_calls(self, users: Sequence[str]) -> list[ContractFunction]:
+        users = [address_table.checksum(u) for u in users]
+        functions = self.lending_pool.contract.functions
+
+        calls = [functions.getUserAccountData(u) for u in users]
+        if isinstance(self.lending_pool, LendingPoolV3):
+            calls += [functions.getUserEMode(u) for u in users]
+        return calls
+
+    def _to_users_info(self, users: Sequence[str], results: Sequence) -> list[UserInfo]:
+        emodes = results[len(users) :] or [None] * len(users)
+        return [self._to_user_info(r, emode) for r, emode in zip(results, emodes)]
+
+    def _to_user_info(self, response: Sequence[int] | None, emode: int | None) -> UserInfo:
+        if response is None:
+            return UserInfo(
+                collateral=math.nan,
+                debt=math.nan,
+                liquidation_threshold=0,
+                healthfactor=math.nan,
+                ltv=0,
+                emode=emode,
+            )
+
+        r = LPUserAccountDataResponse(*response)
+        return UserInfo(
+            collateral=r.collateral / self.base_precision,
+            debt=r.debt / self.base_precision,
+            liquidation_threshold=r.liquidation_threshold,
+            healthfactor=r.healthfactor / 10**DECIMALS_HEALTHF,
+            ltv=r.ltv,
+            emode=emode,
+        )
+
 
 @dataclass
 class PoolPosition:
@@ -277,6 +405,24 @@ class PoolPosition:
     balance_threshold: float = 0
     chain_id: ChainId = ChainId.HOMESTEAD
 
+    def __post_init__(self) -> None:
+        for contract in self.contracts:
+            contract.bind(self.chain_id)
+
+    @property
+    def contracts(self) -> list[IsContract]:
+        """Declarations of the pair's contracts"""
+        return [
+            self.amm.lending_pool,
+            self.supply_token,
+            self.supply_token.a_token,
+            self.debt_token,
+            self.debt_token.stable,
+            self.debt_token.var,
+            *self.extra_tokens,
+            *(t.a_token for t in self.extra_tokens),
+        ]
+
     @cached_property
     def name(self) -> str:
         """Get position name"""
@@ -286,15 +432,20 @@ class PoolPosition:
             return f"{name}-{chain_suffix}"
         return name
 
+    @cached_property
+    def key(self) -> str:
+        """Get position identifier which doesn't require any calls to the node"""
+        return ":".join((str(int(self.chain_id)), self.supply_token.a_token.address, self.debt_token.address)).lower()
+
     def get_total_supply(self, user: str, block: BlockIdentifier) -> float:
         """Get user total supplied amount of the collateral token"""
         a_token = self.supply_token.a_token
-        user = w3.toChecksumAddress(user)
+        user = address_table.checksum(user)
         return a_token.contract.functions.balanceOf(user).call(block_identifier=block) / a_token.precision
 
     def get_total_debt(self, user: str, block: BlockIdentifier) -> float:
         """Get user total borrowed amount of the debt token"""
-        address = w3.toChecksumAddress(user)
+        address = address_table.checksum(user)
         return sum(
             (
                 self.debt_token.stable.functions.balanceOf(address).call(block_identifier=block)
@@ -304,6 +455,28 @@ class PoolPosition:
             )
         )
 
+    def get_total_supplies(self, users: Sequence[str], block: BlockIdentifier) -> list[float]:
+        """Get total supplied amounts of the collateral token for the given users"""
+        return self.supply_token.a_token.balances(users, block)
+
+    async def get_total_supplies_async(self, users: Sequence[str], block: BlockIdentifier) -> list[float]:
+        """Asyncio counterpart of `get_total_supplies`"""
+        return await self.supply_token.a_token.balances_async(users, block)
+
+    def get_total_debts(self, users: Sequence[str], block: BlockIdentifier) -> list[float]:
+        """Get total borrowed amounts of the debt token for the given users"""
+        stable = self.debt_token.stable.balances(users, block)
+        var = self.debt_token.var.balances(users, block)
+        return [s + v for s, v in zip(stable, var)]
+
+    async def get_total_debts_async(self, users: Sequence[str], block: BlockIdentifier) -> list[float]:
+        """Asyncio counterpart of `get_total_debts`"""
+        stable, var = await asyncio.gather(
+            self.debt_token.stable.balances_async(users, block),
+            self.debt_token.var.balances_async(users, block),
+        )
+        return [s + v for s, v in zip(stable, var)]
+
     def get_supply_token_price(self, block: BlockIdentifier) -> float:
         """Get supply token price in base units"""
         return self.amm.get_asset_price(self.supply_token.address, block)
@@ -316,6 +489,10 @@ class PoolPosition:
         """Get token price in base units"""
         return self.amm.get_asset_price(token, block)
 
+    async def get_token_price_async(self, token: str, block: BlockIdentifier) -> float:
+        """Asyncio counterpart of `get_token_price`"""
+        return await self.amm.get_asset_price_async(token, block)
+
 
 @dataclass
 class Context:
@@ -323,5 +500,18 @@ class Context:
 
     init_block: int = 0
     curr_block: int = 0
+    logs_batch: int = 0  # current size of the blocks range to fetch logs within
 
     holders: AddressSet = field(default_factory=AddressSet)
+
+    positions: pd.DataFrame | None = None  # users' positions read during the previous cycles, see positions module
+    cycles_since_full_refresh: int = 0
+
+    healthf: "HealthFactors | None" = None  # local health factors engine, see healthf module
+    trigger: "RefreshTrigger | None" = None  # signals to refresh the positions by, see trigger module
+    liquidations: list["LiquidationIndex"] = field(default_factory=list)  # of every bin by the last cycle
+
+
+def _scale(value: int | None, precision: int) -> float:
+    """Convert raw integer value to float, NaN stands for unknown value"""
+    return math.nan if value is None else value / precision
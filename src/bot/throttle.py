@@ -0,0 +1,207 @@
+"""Rate limiting of requests to the node endpoints"""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from functools import cache
+from typing import Any
+from urllib.parse import urlparse
+
+from .config import RPC_RATE_LIMIT
+from .consts import (
+    RATE_LIMIT_ERROR_CODES,
+    RATE_LIMIT_ERRORS,
+    THROTTLE_BACKOFF_BASE,
+    THROTTLE_BACKOFF_MAX,
+    THROTTLE_BURST,
+)
+from .metrics import ETH_RPC_THROTTLE_STATE
+
+log = logging.getLogger(__name__)
+
+
+class RateLimitError(Exception):
+    """Request has been rejected by the endpoint due to the rate limit"""
+
+    def __init__(self, message: str, code: int, retry_after: float | None = None) -> None:
+        super().__init__(message)
+        self.code = code  # HTTP status or JSON-RPC error code
+        self.retry_after = retry_after
+
+
+class Throttle:
+    """Token bucket of the endpoint shared by all the threads and the event loop.
+
+    Requests are let through at `rate` per second with bursts up to `burst` requests, 0 rate for unlimited.
+    Once the endpoint responds with the rate limit error, all the requests are held for Retry-After seconds
+    or for the exponential backoff growing with every rate limit error in a row."""
+
+    def __init__(self, provider: str, rate: float, burst: float) -> None:
+        self.provider = provider
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._lock = threading.Lock()
+        self._tat = 0.0  # theoretical arrival time of the next request, see GCRA
+        self._paused_until = 0.0
+        self._strikes = 0
+
+    def acquire(self) -> None:
+        """Wait for the request to be let through"""
+
+        while (delay := self._take()) > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self) -> None:
+        """Asyncio counterpart of `acquire`"""
+
+        while (delay := self._take()) > 0:
+            await asyncio.sleep(delay)
+
+    def pause(self, retry_after: float | None) -> None:
+        """Hold the requests after the rate limit error"""
+
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._paused_until:
+                self._strikes += 1
+            if retry_after is None:
+                # equal jitter keeps the pause growing while spreading the resumption
+                backoff = min(THROTTLE_BACKOFF_MAX, THROTTLE_BACKOFF_BASE * 2 ** (self._strikes - 1))
+                retry_after = backoff / 2 + random.uniform(0, backoff / 2)
+            self._paused_until = max(self._paused_until, now + retry_after)
+
+        ETH_RPC_THROTTLE_STATE.labels(provider=self.provider).state("paused")
+        log.warning("%s is rate limited, requests are paused for %.1f seconds", self.provider, retry_after)
+
+    def reset(self) -> None:
+        """Forget the rate limit errors in a row once a request succeeds"""
+        self._strikes = 0
+
+    def _take(self) -> float:
+        """Take a token if there is any, otherwise get the time to wait for it.
+        Tokens are taken right before the requests, so the waiters woken up late don't make a burst"""
+
+        now = time.monotonic()
+        with self._lock:
+            ready = self._paused_until
+            if self.rate > 0:
+                ready = max(ready, self._tat - (self.burst - 1) / self.rate)
+            delay = ready - now
+            if delay <= 0 and self.rate > 0:
+                self._tat = max(self._tat, now) + 1 / self.rate
+            state = "paused" if self._paused_until > now else "limited" if delay > 0 else "open"
+
+        ETH_RPC_THROTTLE_STATE.labels(provider=self.provider).state(state)
+        return delay
+
+
+class InFlightLimiter:
+    """Bound of the requests in flight shared by all the threads and the event loop.
+
+    Slots released are handed over to the waiters in order of their arrival, whether a waiter is a thread
+    or a coroutine, so neither of the fetch backends can starve the other one."""
+
+    def __init__(self, limit: int) -> None:
+        self.limit = max(limit, 1)
+        self._lock = threading.Lock()
+        self._taken = 0
+        self._waiters: deque[threading.Event | asyncio.Future] = deque()
+
+    def acquire(self) -> None:
+        """Wait for a free slot"""
+
+        with self._lock:
+            if self._take():
+                return
+            event = threading.Event()
+            self._waiters.append(event)
+        event.wait()  # the slot is handed over by `release`
+
+    async def acquire_async(self) -> None:
+        """Asyncio counterpart of `acquire`"""
+
+        with self._lock:
+            if self._take():
+                return
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.append(future)
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                if future in self._waiters:
+                    self._waiters.remove(future)
+                    raise
+            # the slot has been handed over already, a cancelled future gets it released by `_hand_over`
+            if not future.cancelled():
+                self.release()
+            raise
+
+    def release(self) -> None:
+        """Hand the slot over to the first waiter or free it"""
+
+        with self._lock:
+            if not self._waiters:
+                self._taken -= 1
+                return
+            waiter = self._waiters.popleft()
+
+        if isinstance(waiter, threading.Event):
+            waiter.set()
+        else:
+            waiter.get_loop().call_soon_threadsafe(self._hand_over, waiter)
+
+    def _take(self) -> bool:
+        if self._taken < self.limit and not self._waiters:
+            self._taken += 1
+            return True
+        return False
+
+    def _hand_over(self, future: asyncio.Future) -> None:
+        if future.cancelled():
+            self.release()
+        else:
+            future.set_result(None)
+
+
+@cache
+def get_throttle(endpoint: str) -> Throttle:
+    """Get throttle of the endpoint"""
+
+    return Throttle(
+        urlparse(endpoint).hostname or "unknown",
+        rate=RPC_RATE_LIMIT,
+        burst=THROTTLE_BURST,
+    )
+
+
+def is_rate_limited(error: Any) -> bool:
+    """Check whether JSON-RPC error object is the rate limit one"""
+
+    if not isinstance(error, dict):
+        return False
+    if error.get("code") in RATE_LIMIT_ERROR_CODES:
+        return True
+    message = str(error.get("message", "")).lower()
+    return any(e in message for e in RATE_LIMIT_ERRORS)
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Get seconds to wait by Retry-After header given either in seconds or as HTTP date"""
+
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        log.warning("Unable to parse Retry-After header: %s", value)
+        return None
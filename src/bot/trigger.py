@@ -0,0 +1,86 @@
+"""Refresh of the positions triggered by the on-chain signals"""
+
+import logging
+import time
+
+from .config import REFRESH_TRIGGER, TRIGGER_EVENTS_COUNT, TRIGGER_PRICE_CHANGE
+from .eth import get_web3
+from .metrics import REFRESH_TRIGGERS
+from .positions import get_position_events
+from .structs import Context, PoolPosition
+
+log = logging.getLogger(__name__)
+
+
+class RefreshTrigger:
+    """Decides whether the positions of the worker are worth a refresh by the cheap signals polled between the cycles.
+
+    The positions are refreshed once the price of the supply or the debt token moves by `TRIGGER_PRICE_CHANGE` percent,
+    or `TRIGGER_EVENTS_COUNT` events of the pool touching the tokens are emitted since the last refresh. Otherwise
+    the positions are refreshed anyway the interval of the worker after the last refresh."""
+
+    def __init__(self, ctx: Context, pair: PoolPosition, interval: float) -> None:
+        self.ctx = ctx
+        self.pair = pair
+        self.interval = interval
+        self.prices: tuple[float, float] | None = None  # prices of the supply and debt tokens at the last refresh
+        self.events = 0  # relevant events since the last refresh
+        self.checked_block = 0  # block the events are counted up to
+        self.refreshed_at = 0.0
+
+        tokens = (pair.supply_token.address, pair.debt_token.address)
+        self._topics = {"0x" + "0" * 24 + t.lower().removeprefix("0x") for t in tokens}
+
+    def check(self) -> str | None:
+        """Get the reason to refresh the positions, None if nothing relevant has changed since the last refresh"""
+
+        reason = self._check()
+        REFRESH_TRIGGERS.labels(self.pair.name, reason or "none").inc()
+        if reason is None:
+            log.info("Nothing relevant has changed for %s up to the block %d", self.pair.name, self.checked_block)
+        else:
+            log.info("Refresh of %s is triggered by %s", self.pair.name, reason)
+        return reason
+
+    def reset(self) -> None:
+        """Take the state of the chain at the block of the last fetch as the baseline"""
+
+        block = self.ctx.init_block
+        self.prices = self._get_prices(block)
+        self.events = 0
+        self.checked_block = block
+        self.refreshed_at = time.monotonic()
+
+    def _check(self) -> str | None:
+        if self.prices is None or time.monotonic() - self.refreshed_at >= self.interval:
+            return "interval"
+
+        block = get_web3(self.pair.chain_id).eth.block_number
+        if block <= self.checked_block:
+            return None
+
+        for price, baseline in zip(self._get_prices(block), self.prices):
+            if baseline and abs(price / baseline - 1) * 100 >= TRIGGER_PRICE_CHANGE:
+                return "price"
+
+        events = get_position_events(self.pair, self.checked_block + 1, block, self.ctx.logs_batch)
+        self.events += sum(1 for e in events if self._topics.intersection(t.hex() for t in e["topics"][1:]))
+        self.checked_block = block
+        if self.events >= TRIGGER_EVENTS_COUNT:
+            return "events"
+
+        return None
+
+    def _get_prices(self, block: int) -> tuple[float, float]:
+        return self.pair.get_supply_token_price(block), self.pair.get_debt_token_price(block)
+
+
+def get_trigger(ctx: Context, pair: PoolPosition, interval: float) -> RefreshTrigger | None:
+    """Get refresh trigger of the worker if the refresh is triggered by the on-chain signals"""
+
+    if REFRESH_TRIGGER != "onchain":
+        return None
+
+    if ctx.trigger is None:
+        ctx.trigger = RefreshTrigger(ctx, pair, interval)
+    return ctx.trigger
@@ -25,6 +25,7 @@ class Worker:
     ctx: Context
     pair: PoolPosition
     bins: Iterable[Bin] = field(default_factory=list)
+    interval: int | None = None  # seconds between the cycles, PARSE_INTERVAL of the chain by default
 
 
 # https://docs.aave.com/developers/v/2.0/deployed-contracts/deployed-contracts